@@ -1,35 +1,59 @@
-import struct
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
+import math
 import os
+import queue
+import threading
+import time
+import zipfile
+from collections import deque
 
-# Fixed offsets
-WATER_HEIGHT_OFFSET = 0xB0
-WATER_PATH_OFFSET = 0xB9
-WATER_PATH_MAX_OFFSET = 0x1BF
-FIX_BYTES = bytes.fromhex("C0E440FFFFFF")
-FIX_OFFSET_START = 0x21
-
-# Template copy range (inclusive start, exclusive end for python slicing)
-TEMPLATE_START = 0x00
-TEMPLATE_END = 0xF0  # 0x00..0xEF inclusive -> slice up to 0xF0
-
-# Embedded template data (240 bytes)
-EMBEDDED_TEMPLATE = bytes.fromhex(
-    "52 10 00 E9 09 00 00 00 64 5C 00 00 50 5C 00 00 00 00 00 00 21 00 00 00 00 00 00 00 00 00 00 00 00 C0 E4 40 FF FF FF 00 5C 59 00 00 04 00 00 00 01 00 00 00 00 61 6D 65 72 65 34 00 60 BC A9 0A 00 00 02 01 1D 64 E0 4F 15 00 00 00 60 A0 CE 34 60 A0 CE 34 00 00 00 00 E3 7B C2 94 2C FB 3F 0F 60 A0 CE 34 3C FB 3F 0F 00 00 00 00 00 00 00 00 D4 F9 3F 0F 10 EA E0 4F 40 00 00 00 00 00 00 00 20 60 CE 34 00 00 00 00 E8 30 CF 34 08 8D A9 0A 01 00 00 00 B8 21 0F 40 8C FB 3F 0F 00 00 00 00 00 00 48 43 00 00 80 C0 01 00 00 00 00 00 00 00 00 00 00 3F 00 00 00 00 00 67 72 61 70 68 69 63 73 5C 5F 6D 61 74 65 72 69 61 6C 73 5C 65 64 69 74 6F 72 5C 77 61 74 65 72 5F 61 76 5F 72 61 69 6E 66 6F 72 65 73 74 2E 6D 6C 6D 00 00 00 00 00"
-)
-
-# Water file paths (displayed strings; bytes are written with single backslashes)
-WATER_PATHS_BYTES = [
-    b"graphics\\_materials\\editor\\df_water_default_top.mlm",
-    b"graphics\\_materials\\editor\\water_av_openfield.mlm",
-    b"graphics\\_materials\\editor\\water_av_rainforest.mlm",
-    b"graphics\\_materials\\editor\\water_av_rainforest_prolemuris_noreflection.mlm",
-    b"graphics\\_materials\\editor\\water_av_riverbank.mlm",
-    b"graphics\\_materials\\editor\\water_av_swamp.mlm",
-]
-
-WATER_PATHS_STR = [p.decode('ascii') for p in WATER_PATHS_BYTES]
+import water_metrics
+from sector_io import WATER_PATHS_STR, EditHistory, SectorIndex, WriteBehind, check_height, list_sectors, recover_journals
+from sector_watch import FolderWatcher
+from sector_zip import ArchiveEdits, SectorArchive
+from water_diff import compare_folders
+from water_report import build_report, write_csv, write_json
+
+# Map zoom limits (pixels per cell); labels are hidden below LABEL_MIN_CELL_SIZE
+MIN_CELL_SIZE = 4
+MAX_CELL_SIZE = 120
+DEFAULT_CELL_SIZE = 30
+LABEL_MIN_CELL_SIZE = 18
+
+# How often (ms) the Tk thread picks up sectors changed on disk by other programs
+WATCH_POLL_MS = 500
+
+# Height map mode: HEIGHT_SCALE spans the slider range, colours run blue -> red
+HEIGHT_SCALE = (0.0, 50.0)
+HEAT_STOPS = [(0x1e, 0x3a, 0x8a), (0x1e, 0x88, 0xe5), (0x50, 0xfa, 0x7b), (0xf1, 0xfa, 0x8c), (0xff, 0x55, 0x55)]
+
+def heat_color(height):
+    low, high = HEIGHT_SCALE
+    t = min(1.0, max(0.0, (height - low) / (high - low))) if height == height else 0.0
+    pos = t * (len(HEAT_STOPS) - 1)
+    k = min(int(pos), len(HEAT_STOPS) - 2)
+    frac = pos - k
+    r, g, b = (round(a + (c - a) * frac) for a, c in zip(HEAT_STOPS[k], HEAT_STOPS[k + 1]))
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+def grid_dimensions(sector_count, columns=None):
+    # (columns, rows) of the sector map. Without a configured width the layout is the
+    # smallest square holding every sector, never below the classic 16x16.
+    if columns:
+        return columns, max(1, math.ceil(sector_count / columns))
+    side = max(16, math.ceil(math.sqrt(sector_count)))
+    return side, max(16, math.ceil(sector_count / side))
+
+def scan_sectors(index, known, sectors, generation, cancel, results):
+    # Worker thread: only reads files and posts (generation, sector, (key, state, digest))
+    # tuples, ending with a (generation, None, None) marker unless cancelled. Sectors
+    # whose stat key matches the persisted cache snapshot are not read at all.
+    for sector_index in sectors:
+        if cancel.is_set():
+            return
+        results.put((generation, sector_index, index.scan(sector_index, known)))
+    results.put((generation, None, None))
 
 class ModernWaterEditor:
     def __init__(self, root):
@@ -50,6 +74,8 @@ class ModernWaterEditor:
             'grid_bg': '#2a2a3e',
             'sector_water': '#1e88e5',
             'sector_selected': '#ff6b6b',
+            'sector_scanning': '#4a4a5e',
+            'sector_pending': '#ffb86c',
             'grid_line': '#404050'
         }
 
@@ -57,9 +83,52 @@ class ModernWaterEditor:
         self.setup_styles()
 
         self.sdat_folder = None
+        self.index = None
+        self.history = None
+        # Set while a zip archive is open; sdat_folder then holds the archive path and
+        # index is the archive itself
+        self.archive = None
+
+        # Background writer; pending_writes counts queued edits per sector until the
+        # writer reports them committed
+        self.writer = None
+        self.pending_writes = {}
+        self.reload_after_write = set()
+        self.write_poll_scheduled = False
         self.current_sector = None
+        self.sector_files = set()
+
+        # Multi-sector selection (always includes current_sector) and rubber-band drag
+        self.selection = set()
+        self.drag_start = None
+        self.drag_extend = False
+        self.band_item = None
+
+        # Sector map viewport: world size in cells, scroll offset in pixels and zoom
+        self.grid_cols, self.grid_rows = grid_dimensions(256)
+        self.cell_size = DEFAULT_CELL_SIZE
+        self.view_x = 0
+        self.view_y = 0
+        self.pan_anchor = None
+        self.rendered_cell_size = None
+
+        # Background folder scan; results are tagged with scan_generation so a
+        # cancelled or superseded scan can never update the current folder
+        self.scan_generation = 0
+        self.scan_cancel = None
+        self.scan_results = None
+        self.scan_pending = set()
+
+        # Folder watcher: candidates reported while a write to the sector is still queued
+        # are kept in watch_deferred and checked once the write has landed
+        self.watcher = None
+        self.watch_deferred = set()
 
         self.create_ui()
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+        self.root.bind('<Control-z>', lambda event: self.undo_edit())
+        self.root.bind('<Control-y>', lambda event: self.redo_edit())
+        self.root.bind('<Control-Z>', lambda event: self.redo_edit())
 
     def setup_styles(self):
         style = ttk.Style()
@@ -92,6 +161,20 @@ class ModernWaterEditor:
         # Controls (left)
         self.load_btn = ttk.Button(left_panel, text="📁 Load SDAT Folder", command=self.load_sdat_folder, style='Accent.TButton')
         self.load_btn.pack(fill='x', pady=(0,8))
+        archive_row = ttk.Frame(left_panel)
+        archive_row.pack(fill='x', pady=(0,8))
+        self.open_archive_btn = ttk.Button(archive_row, text="📦 Open SDAT Archive...", command=self.load_sdat_archive)
+        self.open_archive_btn.pack(side='left', fill='x', expand=True)
+        self.save_archive_btn = ttk.Button(archive_row, text="💾 Save Archive", command=self.save_archive, state='disabled')
+        self.save_archive_btn.pack(side='left', fill='x', expand=True, padx=(8,0))
+        self.cancel_scan_btn = ttk.Button(left_panel, text="⏹ Cancel Scan", command=self.cancel_scan, state='disabled')
+        self.cancel_scan_btn.pack(fill='x', pady=(0,8))
+        self.rescan_btn = ttk.Button(left_panel, text="♻ Rescan Folder (clear cache)", command=self.rescan_folder)
+        self.rescan_btn.pack(fill='x', pady=(0,8))
+        self.report_btn = ttk.Button(left_panel, text="📊 Water Report...", command=self.export_report)
+        self.report_btn.pack(fill='x', pady=(0,8))
+        self.compare_btn = ttk.Button(left_panel, text="🔀 Compare With Folder...", command=self.compare_folder)
+        self.compare_btn.pack(fill='x', pady=(0,8))
         self.status_label = ttk.Label(left_panel, text="No folder loaded", foreground=self.colors['text_secondary'])
         self.status_label.pack(pady=(6,8))
 
@@ -121,6 +204,15 @@ class ModernWaterEditor:
         self.path_dropdown = ttk.Combobox(left_panel, textvariable=self.path_var, values=WATER_PATHS_STR, state='readonly')
         self.path_dropdown.pack(fill='x', pady=(0,8))
 
+        # Fields Save writes to every selected sector
+        apply_frame = ttk.Frame(left_panel, style='Card.TFrame')
+        apply_frame.pack(fill='x')
+        ttk.Label(apply_frame, text="Save writes:").pack(side='left', padx=(0,6))
+        self.apply_height_var = tk.BooleanVar(value=True)
+        self.apply_material_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(apply_frame, text="Height", variable=self.apply_height_var).pack(side='left', padx=(0,6))
+        ttk.Checkbutton(apply_frame, text="Material", variable=self.apply_material_var).pack(side='left')
+
         # Save and reset buttons
         button_frame = ttk.Frame(left_panel)
         button_frame.pack(fill='x', pady=(10,8))
@@ -131,20 +223,90 @@ class ModernWaterEditor:
         self.reset_btn = ttk.Button(button_frame, text="🔄 Reset Sector (clear water)", command=self.reset_current_sector, style='Warning.TButton')
         self.reset_btn.pack(fill='x')
 
+        # Undo/redo of committed edits (Ctrl+Z / Ctrl+Y)
+        history_frame = ttk.Frame(left_panel)
+        history_frame.pack(fill='x', pady=(0,4))
+        self.undo_btn = ttk.Button(history_frame, text="↶ Undo", command=self.undo_edit, state='disabled')
+        self.undo_btn.pack(side='left', fill='x', expand=True, padx=(0,3))
+        self.redo_btn = ttk.Button(history_frame, text="↷ Redo", command=self.redo_edit, state='disabled')
+        self.redo_btn.pack(side='left', fill='x', expand=True, padx=(3,0))
+        self.history_label = ttk.Label(left_panel, text='', foreground=self.colors['text_secondary'], font=('Segoe UI', 8))
+        self.history_label.pack()
+
         self.sector_info = ttk.Label(left_panel, text="Select a sector to edit", foreground=self.colors['text_secondary'])
         self.sector_info.pack(pady=(12,0))
 
+        # Diagnostics (collapsed by default)
+        self.diag_toggle_btn = ttk.Button(left_panel, text="▸ Diagnostics", command=self.toggle_diagnostics)
+        self.diag_toggle_btn.pack(fill='x', pady=(12,0))
+        self.diag_frame = ttk.Frame(left_panel, style='Card.TFrame')
+        self.diag_visible = False
+        self.diag_after = None
+        self.diag_enabled_var = tk.BooleanVar(value=water_metrics.ENABLED)
+        ttk.Checkbutton(self.diag_frame, text="Record I/O and latency", variable=self.diag_enabled_var, command=self.toggle_metrics).pack(anchor='w', pady=(6,0))
+        self.diag_text = tk.Text(self.diag_frame, height=10, width=60, bg=self.colors['bg_tertiary'], fg=self.colors['text'], relief='flat', font=('Consolas', 8), wrap='none', state='disabled')
+        self.diag_text.pack(fill='both', expand=True, pady=(6,6))
+        diag_buttons = ttk.Frame(self.diag_frame, style='Card.TFrame')
+        diag_buttons.pack(fill='x')
+        ttk.Button(diag_buttons, text="Reset", command=self.reset_metrics).pack(side='left', padx=(0,6))
+        ttk.Button(diag_buttons, text="Export JSON...", command=self.export_metrics).pack(side='left')
+
         # Grid (right)
-        ttk.Label(right_panel, text="🗺️ Sector Map", font=('Segoe UI', 11, 'bold')).pack()
+        map_header = ttk.Frame(right_panel, style='Card.TFrame')
+        map_header.pack(fill='x')
+        ttk.Label(map_header, text="🗺️ Sector Map", font=('Segoe UI', 11, 'bold')).pack(side='left')
+        ttk.Button(map_header, text="Fit", width=4, command=self.fit_map).pack(side='right')
+        ttk.Button(map_header, text="−", width=3, command=lambda: self.zoom_map(1 / 1.25)).pack(side='right', padx=(0,4))
+        ttk.Button(map_header, text="+", width=3, command=lambda: self.zoom_map(1.25)).pack(side='right', padx=(0,4))
+
+        map_options = ttk.Frame(right_panel, style='Card.TFrame')
+        map_options.pack(fill='x', pady=(6,0))
+        ttk.Label(map_options, text="Color by").pack(side='left', padx=(0,4))
+        self.map_mode_var = tk.StringVar(value='Water')
+        map_mode_box = ttk.Combobox(map_options, textvariable=self.map_mode_var, values=['Water', 'Height'], width=8, state='readonly')
+        map_mode_box.pack(side='left')
+        map_mode_box.bind('<<ComboboxSelected>>', lambda event: self.refresh_sectors(list(self.cell_items)))
+        self.columns_var = tk.StringVar(value='Auto')
+        columns_box = ttk.Combobox(map_options, textvariable=self.columns_var, values=['Auto', '16', '32', '64', '128'], width=6)
+        columns_box.pack(side='right')
+        columns_box.bind('<<ComboboxSelected>>', self.apply_grid_columns)
+        columns_box.bind('<Return>', self.apply_grid_columns)
+        ttk.Label(map_options, text="Columns").pack(side='right', padx=(0,4))
+
         self.grid_canvas = tk.Canvas(right_panel, width=480, height=480, bg=self.colors['grid_bg'], highlightthickness=0)
-        self.grid_canvas.pack(pady=(12,0))
-        self.grid_canvas.bind('<Button-1>', self.select_sector)
+        self.grid_canvas.pack(fill='both', expand=True, pady=(12,0))
+        # Click selects, Shift+click toggles, left-drag selects a rectangle (Shift adds)
+        # and double-click selects the connected region with the same water state
+        self.grid_canvas.bind('<ButtonPress-1>', self.press_select)
+        self.grid_canvas.bind('<B1-Motion>', self.drag_select)
+        self.grid_canvas.bind('<ButtonRelease-1>', self.release_select)
+        self.grid_canvas.bind('<Double-Button-1>', self.flood_select)
+        # Drag with the middle or right button to pan; wheel scrolls, Shift+wheel
+        # scrolls sideways and Ctrl+wheel zooms around the pointer
+        for button in (2, 3):
+            self.grid_canvas.bind(f'<ButtonPress-{button}>', self.start_pan)
+            self.grid_canvas.bind(f'<B{button}-Motion>', self.drag_pan)
+        self.grid_canvas.bind('<MouseWheel>', self.on_map_wheel)
+        self.grid_canvas.bind('<Button-4>', self.on_map_wheel)
+        self.grid_canvas.bind('<Button-5>', self.on_map_wheel)
+        self.grid_canvas.bind('<Configure>', lambda event: self.render_viewport())
 
         legend_frame = ttk.Frame(right_panel)
         legend_frame.pack(pady=(10,0))
         self.create_legend_item(legend_frame, self.colors['grid_bg'], "Empty")
         self.create_legend_item(legend_frame, self.colors['sector_water'], "Water")
         self.create_legend_item(legend_frame, self.colors['sector_selected'], "Selected")
+        self.create_legend_item(legend_frame, self.colors['sector_scanning'], "Scanning")
+        self.create_legend_item(legend_frame, self.colors['sector_pending'], "Writing")
+        heat_legend = tk.Canvas(legend_frame, width=60, height=20, bg=self.colors['bg_secondary'], highlightthickness=0)
+        heat_legend.pack(side='left', padx=(8,6))
+        for k in range(10):
+            heat_legend.create_rectangle(2 + k * 5.6, 2, 7.6 + k * 5.6, 18, fill=heat_color(HEIGHT_SCALE[0] + (HEIGHT_SCALE[1] - HEIGHT_SCALE[0]) * k / 9), width=0)
+        ttk.Label(legend_frame, text=f"Height {HEIGHT_SCALE[0]:g}–{HEIGHT_SCALE[1]:g}").pack(side='left')
+
+        self.redraw_ms = deque(maxlen=50)
+        self.redraw_label = ttk.Label(right_panel, text='', foreground=self.colors['text_secondary'], font=('Segoe UI', 8))
+        self.redraw_label.pack(pady=(6,0))
 
         self.draw_sector_grid()
 
@@ -156,40 +318,196 @@ class ModernWaterEditor:
         canvas.create_rectangle(2,2,18,18, fill=color, outline=self.colors['grid_line'])
         ttk.Label(item, text=text).pack(side='left')
 
+    @water_metrics.timed('draw_sector_grid')
     def draw_sector_grid(self):
+        # Drops every canvas item (the world layout changed) and renders the viewport
         self.grid_canvas.delete('all')
-        cell_size = 30
-        for y in range(16):
-            for x in range(16):
-                sector_index = y * 16 + x
-                display_x = x * cell_size
-                display_y = (15 - y) * cell_size
-                has_water = self.sector_has_water(sector_index)
-                is_selected = (sector_index == self.current_sector)
-                fill_color = self.colors['grid_bg']
-                if has_water: fill_color = self.colors['sector_water']
-                if is_selected: fill_color = self.colors['sector_selected']
-                outline_color = self.colors['grid_line']
-                outline_width = 3 if is_selected else 1
-                self.grid_canvas.create_rectangle(display_x, display_y, display_x + cell_size, display_y + cell_size, outline=outline_color, fill=fill_color, width=outline_width)
-                text_color = 'white' if (has_water or is_selected) else self.colors['text_secondary']
-                self.grid_canvas.create_text(display_x + cell_size/2, display_y + cell_size/2, text=str(sector_index), fill=text_color, font=('Segoe UI', 8))
+        self.cell_items = {}
+        self.band_item = None
+        self.rendered_cell_size = None
+        self.clamp_view()
+        self.render_viewport()
+
+    def viewport_size(self):
+        width = self.grid_canvas.winfo_width()
+        height = self.grid_canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            # Not mapped yet: use the requested size
+            width = int(self.grid_canvas.cget('width'))
+            height = int(self.grid_canvas.cget('height'))
+        return width, height
+
+    def cell_origin(self, sector_index):
+        # Canvas coordinates of a cell's top-left corner; row 0 is drawn at the bottom
+        row, col = divmod(sector_index, self.grid_cols)
+        return col * self.cell_size - self.view_x, (self.grid_rows - 1 - row) * self.cell_size - self.view_y
+
+    def cell_at(self, x, y):
+        col = int((x + self.view_x) // self.cell_size)
+        row = self.grid_rows - 1 - int((y + self.view_y) // self.cell_size)
+        if col < 0 or col >= self.grid_cols or row < 0 or row >= self.grid_rows:
+            return None
+        return row * self.grid_cols + col
+
+    def visible_sectors(self):
+        width, height = self.viewport_size()
+        cell_size = self.cell_size
+        first_col = max(0, int(self.view_x // cell_size))
+        last_col = min(self.grid_cols, int((self.view_x + width) // cell_size) + 1)
+        first_line = max(0, int(self.view_y // cell_size))
+        last_line = min(self.grid_rows, int((self.view_y + height) // cell_size) + 1)
+        for line in range(first_line, last_line):
+            row = self.grid_rows - 1 - line
+            for col in range(first_col, last_col):
+                yield row * self.grid_cols + col
+
+    @water_metrics.timed('render_viewport')
+    def render_viewport(self):
+        # Only cells inside the viewport have canvas items: cells that scrolled out are
+        # deleted, newly visible ones created and styled, the rest just moved. Cost and
+        # item count follow the viewport size, not the world size.
+        start = time.perf_counter()
+        visible = set(self.visible_sectors())
+        for sector_index in [s for s in self.cell_items if s not in visible]:
+            self.grid_canvas.delete(*self.cell_items.pop(sector_index))
+        cell_size = self.cell_size
+        half = cell_size / 2
+        zoomed = cell_size != self.rendered_cell_size
+        self.rendered_cell_size = cell_size
+        label_state = 'normal' if cell_size >= LABEL_MIN_CELL_SIZE else 'hidden'
+        font = ('Segoe UI', max(6, min(12, int(cell_size) // 4)))
+        created = []
+        for sector_index in visible:
+            x, y = self.cell_origin(sector_index)
+            items = self.cell_items.get(sector_index)
+            if items is None:
+                rect = self.grid_canvas.create_rectangle(x, y, x + cell_size, y + cell_size, outline=self.colors['grid_line'])
+                text = self.grid_canvas.create_text(x + half, y + half, text=str(sector_index), font=font, state=label_state)
+                self.cell_items[sector_index] = (rect, text)
+                created.append(sector_index)
+                continue
+            rect, text = items
+            self.grid_canvas.coords(rect, x, y, x + cell_size, y + cell_size)
+            self.grid_canvas.coords(text, x + half, y + half)
+            if zoomed:
+                self.grid_canvas.itemconfigure(text, font=font, state=label_state)
+        self.style_cells(created)
+        if self.current_sector in self.cell_items:
+            self.grid_canvas.tag_raise(self.cell_items[self.current_sector][0])
+            self.grid_canvas.tag_raise(self.cell_items[self.current_sector][1])
+        self.record_redraw(time.perf_counter() - start)
 
+    def clamp_view(self):
+        width, height = self.viewport_size()
+        self.view_x = min(max(self.view_x, 0), max(0, self.grid_cols * self.cell_size - width))
+        self.view_y = min(max(self.view_y, 0), max(0, self.grid_rows * self.cell_size - height))
+
+    def pan_map(self, dx, dy):
+        self.view_x += dx
+        self.view_y += dy
+        self.clamp_view()
+        self.render_viewport()
+
+    def zoom_map(self, factor, x=None, y=None):
+        # Zooms around (x, y) in canvas coordinates, the viewport centre by default
+        width, height = self.viewport_size()
+        if x is None:
+            x, y = width / 2, height / 2
+        new_size = min(MAX_CELL_SIZE, max(MIN_CELL_SIZE, self.cell_size * factor))
+        if new_size == self.cell_size:
+            return
+        scale = new_size / self.cell_size
+        self.view_x = (self.view_x + x) * scale - x
+        self.view_y = (self.view_y + y) * scale - y
+        self.cell_size = new_size
+        self.clamp_view()
+        self.render_viewport()
+
+    def fit_map(self):
+        width, height = self.viewport_size()
+        self.cell_size = min(MAX_CELL_SIZE, max(MIN_CELL_SIZE, min(width / self.grid_cols, height / self.grid_rows)))
+        self.view_x = self.view_y = 0
+        self.render_viewport()
+
+    def start_pan(self, event):
+        self.pan_anchor = (event.x, event.y)
+
+    def drag_pan(self, event):
+        if self.pan_anchor is None:
+            return
+        dx = self.pan_anchor[0] - event.x
+        dy = self.pan_anchor[1] - event.y
+        self.pan_anchor = (event.x, event.y)
+        self.pan_map(dx, dy)
+
+    def on_map_wheel(self, event):
+        # <MouseWheel> carries a delta (Windows/macOS); X11 sends Button-4/5 instead
+        delta = event.delta or (120 if event.num == 4 else -120)
+        steps = delta / 120
+        if event.state & 0x4:
+            self.zoom_map(1.25 ** steps, event.x, event.y)
+        elif event.state & 0x1:
+            self.pan_map(-steps * 3 * self.cell_size, 0)
+        else:
+            self.pan_map(0, -steps * 3 * self.cell_size)
+
+    def apply_grid_columns(self, event=None):
+        text = self.columns_var.get().strip()
+        columns = int(text) if text.isdigit() and int(text) > 0 else None
+        if columns is None:
+            self.columns_var.set('Auto')
+        sector_count = max(self.sector_files) + 1 if self.sector_files else 256
+        self.grid_cols, self.grid_rows = grid_dimensions(sector_count, columns)
+        self.draw_sector_grid()
+
+    @water_metrics.timed('refresh_sectors')
+    def refresh_sectors(self, sector_indices):
+        # Restyles the given cells; cells outside the viewport are styled when they
+        # scroll into view
+        start = time.perf_counter()
+        self.style_cells(sector_indices)
+        self.record_redraw(time.perf_counter() - start)
+
+    def style_cells(self, sector_indices):
+        for sector_index in sector_indices:
+            if sector_index not in self.cell_items:
+                continue
+            rect, text = self.cell_items[sector_index]
+            is_scanning = sector_index in self.scan_pending
+            has_water = not is_scanning and self.sector_has_water(sector_index)
+            is_current = (sector_index == self.current_sector)
+            is_selected = is_current or sector_index in self.selection
+            fill_color = self.colors['grid_bg']
+            if is_scanning: fill_color = self.colors['sector_scanning']
+            if has_water:
+                if self.map_mode_var.get() == 'Height':
+                    fill_color = heat_color(self.index.peek(sector_index).height)
+                else:
+                    fill_color = self.colors['sector_water']
+            if is_selected: fill_color = self.colors['sector_selected']
+            # Edits still queued on the writer get a highlighted outline
+            outline = self.colors['sector_pending'] if sector_index in self.pending_writes else self.colors['grid_line']
+            self.grid_canvas.itemconfigure(rect, fill=fill_color, outline=outline, width=3 if is_current else 2 if is_selected or outline != self.colors['grid_line'] else 1)
+            text_color = 'white' if (has_water or is_selected) else self.colors['text_secondary']
+            self.grid_canvas.itemconfigure(text, fill=text_color)
+            if is_selected:
+                self.grid_canvas.tag_raise(rect)
+                self.grid_canvas.tag_raise(text)
+
+    def record_redraw(self, seconds):
+        # Latest grid update cost; one frame at 60 Hz is ~16.7 ms
+        ms = seconds * 1000.0
+        self.redraw_ms.append(ms)
+        worst = max(self.redraw_ms)
+        color = self.colors['text_secondary'] if worst < 16.7 else self.colors['warning']
+        self.redraw_label.config(text=f'Redraw {ms:.2f} ms (worst of last {len(self.redraw_ms)}: {worst:.2f} ms)', foreground=color)
+
+    @water_metrics.timed('sector_has_water')
     def sector_has_water(self, sector_index):
-        if self.sdat_folder is None: return False
-        file_path = os.path.join(self.sdat_folder, f'sd{sector_index}.csdat')
-        if not os.path.isfile(file_path): return False
-        try:
-            with open(file_path, 'rb') as f:
-                data = f.read()
-            if len(data) < WATER_HEIGHT_OFFSET + 4:
-                return False
-            height = struct.unpack('<f', data[WATER_HEIGHT_OFFSET:WATER_HEIGHT_OFFSET+4])[0]
-            path_bytes = data[WATER_PATH_OFFSET:WATER_PATH_MAX_OFFSET+1] if len(data) > WATER_PATH_OFFSET else b''
-            path_str = path_bytes.split(b'\x00')[0].decode('ascii', errors='ignore').strip() if path_bytes else ''
-            return (abs(height) > 1e-6) or (path_str != '' and path_str != '00')
-        except:
-            return False
+        if self.index is None or sector_index not in self.sector_files: return False
+        # Scanned sectors are answered from the index without a stat call
+        state = self.index.peek(sector_index) or self.index.get(sector_index)
+        return state is not None and state.has_water
 
     def update_height_display(self, *args):
         self.height_entry_var.set(f"{self.height_var.get():.2f}")
@@ -204,32 +522,255 @@ class ModernWaterEditor:
 
     def load_sdat_folder(self):
         folder = filedialog.askdirectory(title='Select SDAT Folder')
-        if not folder:
+        if not folder or not self.close_sectors():
+            return
+        recover_journals(folder)
+        history = EditHistory(folder)
+        self.open_sectors(folder, SectorIndex(folder), history, WriteBehind(folder, history))
+
+    def load_sdat_archive(self):
+        # Edits go to the archive in memory; Save Archive writes only the edited members
+        path = filedialog.askopenfilename(title='Select SDAT Archive', filetypes=[('Zip archives', '*.zip'), ('All files', '*.*')])
+        if not path:
             return
-        self.sdat_folder = folder
+        try:
+            archive = SectorArchive(path)
+        except (OSError, zipfile.BadZipFile) as e:
+            messagebox.showerror('Error', f'Failed to open archive: {e}')
+            return
+        if not self.close_sectors():
+            archive.close()
+            return
+        self.archive = archive
+        self.open_sectors(path, archive, None, WriteBehind(path, make_edits=lambda: ArchiveEdits(archive)))
+
+    def close_sectors(self):
+        # Writes out queued edits and lets go of the loaded folder or archive. Returns
+        # False when the user keeps an archive with unsaved edits open.
+        self.flush_writes()
+        if self.archive is not None and self.archive.dirty:
+            answer = messagebox.askyesnocancel('Unsaved Archive', f'Save your edits to {os.path.basename(self.archive.path)}?')
+            if answer is None or (answer and not self.save_archive()):
+                return False
+        self.stop_watch()
+        self.cancel_scan(resolve=False)
+        self.close_writer()
+        if self.index is not None:
+            self.index.save_cache()
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        return True
+
+    def open_sectors(self, location, index, history, writer):
+        self.sdat_folder = location
+        self.index = index
+        self.history = history
+        self.writer = writer
+        self.update_history_buttons()
+        self.update_archive_buttons()
+        self.compare_btn.config(state='disabled' if self.archive is not None else 'normal')
         self.current_sector = None
-        self.status_label.config(text="✓ SDAT folder loaded", foreground=self.colors['success'])
-        self.draw_sector_grid()
+        self.selection = set()
+        self.view_x = self.view_y = 0
+        self.start_scan()
+        self.start_watch()
         self.update_sector_info()
 
+    def rescan_folder(self):
+        # Drops the persisted summaries and re-reads every sector
+        if self.index is None:
+            return
+        self.cancel_scan(resolve=False)
+        self.flush_writes()
+        self.index.clear_cache()
+        self.start_scan()
+
+    def on_close(self):
+        # Queued edits are written out before the window goes away
+        if not self.close_sectors():
+            return
+        self.root.destroy()
+
+    def save_archive(self):
+        # Streams a new archive: edited members are recompressed, the rest copied raw
+        if self.archive is None:
+            return False
+        self.flush_writes()
+        if not self.archive.dirty:
+            return True
+        self.status_label.config(text='⏳ Saving archive...', foreground=self.colors['warning'])
+        self.root.update_idletasks()
+        try:
+            rewritten, copied = self.archive.save()
+        except (OSError, zipfile.BadZipFile) as e:
+            self.status_label.config(text='⚠ Archive not saved', foreground=self.colors['warning'])
+            messagebox.showerror('Error', f'Failed to save archive: {e}')
+            return False
+        self.update_archive_buttons()
+        self.status_label.config(text=f'✓ Saved archive: {rewritten} members rewritten, {copied} copied', foreground=self.colors['success'])
+        return True
+
+    def update_archive_buttons(self):
+        dirty = self.archive is not None and self.archive.dirty
+        count = len(self.archive.modified()) if dirty else 0
+        self.save_archive_btn.config(text=f"💾 Save Archive ({count})" if dirty else "💾 Save Archive", state='normal' if dirty else 'disabled')
+
+    def start_scan(self):
+        # Reads every sector on a worker thread; poll_scan applies results on the Tk thread.
+        # The map is sized from the sd{N}.csdat files present.
+        self.scan_generation += 1
+        self.scan_cancel = threading.Event()
+        self.scan_results = queue.Queue()
+        try:
+            self.sector_files = set(self.archive.sectors() if self.archive is not None else list_sectors(self.sdat_folder))
+        except OSError:
+            self.sector_files = set()
+        self.scan_pending = set(self.sector_files)
+        self.apply_grid_columns()
+        self.status_label.config(text=f"⏳ Scanning sectors... 0/{len(self.scan_pending)}", foreground=self.colors['warning'])
+        self.cancel_scan_btn.config(state='normal')
+        # Cells on screen are scanned first
+        order = sorted(self.scan_pending, key=lambda s: (s not in self.cell_items, s))
+        worker = threading.Thread(
+            target=scan_sectors,
+            args=(self.index, self.index.snapshot(), order, self.scan_generation, self.scan_cancel, self.scan_results),
+            daemon=True,
+        )
+        worker.start()
+        self.root.after(30, self.poll_scan, self.scan_generation)
+
+    def poll_scan(self, generation):
+        if generation != self.scan_generation:
+            return
+        changed = []
+        done = False
+        deadline = time.perf_counter() + 0.008
+        while time.perf_counter() < deadline:
+            try:
+                result_generation, sector_index, entry = self.scan_results.get_nowait()
+            except queue.Empty:
+                break
+            if result_generation != generation:
+                continue
+            if sector_index is None:
+                done = True
+                break
+            # Sectors the user loaded or edited meanwhile already have fresher state
+            if sector_index in self.scan_pending:
+                self.scan_pending.discard(sector_index)
+                self.index.put(sector_index, *entry)
+                changed.append(sector_index)
+        self.refresh_sectors(changed)
+        if done:
+            self.scan_cancel = None
+            self.cancel_scan_btn.config(state='disabled')
+            self.status_label.config(text="✓ SDAT archive loaded" if self.archive is not None else "✓ SDAT folder loaded", foreground=self.colors['success'])
+            self.update_sector_info()
+            self.index.save_cache()
+        else:
+            total = len(self.sector_files)
+            self.status_label.config(text=f"⏳ Scanning sectors... {total - len(self.scan_pending)}/{total}", foreground=self.colors['warning'])
+            self.root.after(30, self.poll_scan, generation)
+
+    def cancel_scan(self, resolve=True):
+        # Unscanned sectors stop being drawn as scanning; with resolve, the ones on screen
+        # are restyled now and read through the index as they are styled (the rest when
+        # they scroll into view). Callers about to rescan or switch folders skip that.
+        if self.scan_cancel is None:
+            return
+        self.scan_cancel.set()
+        self.scan_cancel = None
+        self.scan_generation += 1
+        self.cancel_scan_btn.config(state='disabled')
+        unscanned, self.scan_pending = self.scan_pending, set()
+        if self.sdat_folder is not None and resolve:
+            self.status_label.config(text=f"Scan cancelled ({len(unscanned)} sectors are read when shown)", foreground=self.colors['warning'])
+            self.refresh_sectors(unscanned)
+
+    def start_watch(self):
+        # Archives are not watched; their sectors only change through the editor
+        self.stop_watch()
+        if self.archive is not None or self.sdat_folder is None:
+            return
+        try:
+            self.watcher = FolderWatcher(self.sdat_folder)
+        except OSError:
+            return
+        self.root.after(WATCH_POLL_MS, self.poll_watch, self.watcher)
+
+    def stop_watch(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        self.watch_deferred.clear()
+
+    def poll_watch(self, watcher):
+        if watcher is not self.watcher:
+            return
+        changes = watcher.changes()
+        if changes is None or changes or self.watch_deferred:
+            self.apply_disk_changes(changes)
+        self.root.after(WATCH_POLL_MS, self.poll_watch, watcher)
+
+    @water_metrics.timed('apply_disk_changes')
+    def apply_disk_changes(self, sectors):
+        # Re-decodes and redraws only the sectors whose size or mtime moved. sectors is
+        # None when the watcher lost events, in which case every sector is checked.
+        self.apply_write_results()
+        if sectors is None:
+            try:
+                sectors = set(list_sectors(self.sdat_folder)) | self.sector_files
+            except OSError:
+                return
+        sectors = set(sectors) | self.watch_deferred
+        # Our own queued writes land later; the scan reads its pending sectors anyway
+        self.watch_deferred = {s for s in sectors if s in self.pending_writes}
+        current = self.current_sector
+        shown = self.index.peek(current) if current is not None else None
+        changed = [s for s in sorted(sectors - self.watch_deferred - self.scan_pending) if self.index.refresh(s)]
+        if not changed:
+            return
+        files = (self.sector_files | set(changed)) - {s for s in changed if self.index.peek(s) is None}
+        if files != self.sector_files:
+            self.selection &= files
+            self.sector_files = files
+            self.apply_grid_columns()
+        else:
+            self.refresh_sectors(changed)
+        if current in changed:
+            if shown is not None and self.ui_has_unsaved_edits(shown):
+                if messagebox.askyesno('Sector Changed On Disk', f'sd{current}.csdat was changed by another program while you had unsaved edits.\n\nReload it and discard your edits? (No keeps them; saving will overwrite the change.)'):
+                    self.load_sector_into_ui(current)
+            else:
+                self.load_sector_into_ui(current)
+        self.update_sector_info()
+        self.status_label.config(text=f'↻ {len(changed)} sectors changed on disk', foreground=self.colors['accent'])
+
+    def ui_has_unsaved_edits(self, state):
+        # True when the height/material fields no longer show `state`
+        try:
+            height = float(self.height_entry_var.get())
+        except ValueError:
+            return True
+        return round(height, 2) != round(state.height, 2) or self.path_var.get() != state.path
+
+    @water_metrics.timed('load_sector_into_ui')
     def load_sector_into_ui(self, sector_index):
         if self.sdat_folder is None:
             return
-        file_path = os.path.join(self.sdat_folder, f'sd{sector_index}.csdat')
-        if not os.path.isfile(file_path):
+        state = self.index.get(sector_index)
+        if state is None:
             self.current_sector = None
             self.update_sector_info()
             return
         self.current_sector = sector_index
-        with open(file_path, 'rb') as f:
-            data = f.read()
-        height = struct.unpack('<f', data[WATER_HEIGHT_OFFSET:WATER_HEIGHT_OFFSET+4])[0] if len(data) >= WATER_HEIGHT_OFFSET + 4 else 0.0
-        if len(data) >= WATER_PATH_OFFSET:
-            path_bytes = data[WATER_PATH_OFFSET:WATER_PATH_MAX_OFFSET+1]
-            path_str_raw = path_bytes.split(b'\x00')[0].decode('ascii', errors='ignore').strip()
-            path_str = path_str_raw if path_str_raw != '' else '00'
-        else:
-            path_str = '00'
+        self.scan_pending.discard(sector_index)
+        if sector_index in self.pending_writes:
+            # The index still has the pre-write state; show the written one when it lands
+            self.reload_after_write.add(sector_index)
+        height = state.height
+        path_str = state.path
         self.height_var.set(height)
         self.height_entry_var.set(f"{height:.2f}")
         if path_str in WATER_PATHS_STR:
@@ -238,167 +779,470 @@ class ModernWaterEditor:
             self.path_var.set(path_str)
         self.update_sector_info()
 
-    def add_water_block(self):
-        if self.current_sector is None or self.sdat_folder is None:
-            messagebox.showwarning('No Sector', 'Select a sector first.')
+    def target_sectors(self):
+        # The multi-selection, or just the current sector
+        if len(self.selection) > 1:
+            return sorted(self.selection)
+        return [self.current_sector] if self.current_sector is not None else []
+
+    def apply_edits(self, span_name, verb, apply, sectors=None):
+        # Queues apply(edits, sector) for every target (the selection by default) on the
+        # write-behind thread, which reads each header once and commits the whole batch as
+        # one journaled patch (one undo step). Returns (queued, skipped with reasons) right away.
+        sectors = self.target_sectors() if sectors is None else sectors
+        queued = [sector_index for sector_index in sectors if sector_index in self.sector_files]
+        skipped = [(sector_index, 'file not found') for sector_index in sectors if sector_index not in self.sector_files]
+        if queued:
+            label = f'{verb} sector {queued[0]}' if len(queued) == 1 else f'{verb} {len(queued)} sectors'
+            with water_metrics.span(span_name):
+                self.writer.submit(label, queued, apply)
+            for sector_index in queued:
+                self.pending_writes[sector_index] = self.pending_writes.get(sector_index, 0) + 1
+            self.status_label.config(text=f'⏳ Writing: {label}', foreground=self.colors['warning'])
+            self.schedule_write_poll()
+        self.refresh_sectors(sectors)
+        return queued, skipped
+
+    def schedule_write_poll(self):
+        if not self.write_poll_scheduled:
+            self.write_poll_scheduled = True
+            self.root.after(50, self.poll_writes)
+
+    def poll_writes(self):
+        self.write_poll_scheduled = False
+        self.apply_write_results()
+        if self.pending_writes:
+            self.schedule_write_poll()
+
+    def apply_write_results(self):
+        # Tk thread: takes finished commits from the writer into the index and the grid
+        if self.writer is None:
             return
-        target_path = os.path.join(self.sdat_folder, f'sd{self.current_sector}.csdat')
-        if not os.path.isfile(target_path):
-            messagebox.showerror('Missing file', f'{os.path.basename(target_path)} not found.')
+        while True:
+            try:
+                result = self.writer.results.get_nowait()
+            except queue.Empty:
+                break
+            for sector_index, count in result.counts.items():
+                left = self.pending_writes.get(sector_index, 0) - count
+                if left > 0:
+                    self.pending_writes[sector_index] = left
+                else:
+                    self.pending_writes.pop(sector_index, None)
+            for sector_index, (state, header) in result.states.items():
+                self.index.store(sector_index, state, header)
+                self.scan_pending.discard(sector_index)
+            # Show what was written unless more edits for the sector are still queued
+            if self.current_sector in self.reload_after_write and self.current_sector not in self.pending_writes:
+                self.reload_after_write.discard(self.current_sector)
+                self.load_sector_into_ui(self.current_sector)
+            self.refresh_sectors(result.counts)
+            self.update_sector_info()
+            self.update_history_buttons()
+            self.update_archive_buttons()
+            if result.errors:
+                self.status_label.config(text=f'⚠ {result.label}: {len(result.errors)} sectors failed', foreground=self.colors['warning'])
+                messagebox.showerror('Write failed', f'{result.label}\n\n' + self.format_sector_list(result.errors))
+            elif not self.pending_writes:
+                text = f'✓ Saved: {result.label}' if self.archive is None else f'✓ {result.label} (not in the archive until Save Archive)'
+                self.status_label.config(text=text, foreground=self.colors['success'])
+
+    def flush_writes(self):
+        # Blocks until queued edits are on disk and applied to the UI
+        if self.writer is None:
             return
+        if self.writer.busy():
+            self.status_label.config(text='⏳ Writing pending edits...', foreground=self.colors['warning'])
+            self.root.update_idletasks()
+            self.writer.flush()
+        self.apply_write_results()
 
-        try:
-            with open(target_path, 'rb') as f:
-                target_data = bytearray(f.read())
+    def close_writer(self):
+        if self.writer is None:
+            return
+        self.flush_writes()
+        self.writer.close()
+        self.apply_write_results()
+        self.writer = None
+        self.pending_writes.clear()
+        self.reload_after_write.clear()
 
-            # Save original sector byte at 0x14
-            if len(target_data) > 0x14:
-                original_sector_byte = target_data[0x14]
+    def export_report(self):
+        # Audit of every sector (heights, materials, template bytes) saved as CSV or JSON
+        if self.sdat_folder is None:
+            messagebox.showwarning('No Folder', 'Load an SDAT folder first.')
+            return
+        path = filedialog.asksaveasfilename(title='Save Water Report', defaultextension='.csv', filetypes=[('CSV', '*.csv'), ('JSON', '*.json')])
+        if not path:
+            return
+        self.flush_writes()
+        try:
+            rows, summary = build_report(self.archive or self.sdat_folder)
+            if path.lower().endswith('.json'):
+                write_json(rows, summary, path)
             else:
-                original_sector_byte = self.current_sector & 0xFF
-                if len(target_data) < 0x15:
-                    target_data.extend(b'\x00' * (0x15 - len(target_data)))
-
-            # Copy embedded template into target
-            if len(target_data) < TEMPLATE_END:
-                target_data.extend(b'\x00' * (TEMPLATE_END - len(target_data)))
-            target_data[TEMPLATE_START:TEMPLATE_END] = EMBEDDED_TEMPLATE
-            
-            # Restore the original sector byte at 0x14
-            target_data[0x14] = original_sector_byte
-
-            with open(target_path, 'wb') as f:
-                f.write(target_data)
-                f.flush()
-                os.fsync(f.fileno())
-
-            # Reload the sector to show the template's default values
-            self.load_sector_into_ui(self.current_sector)
-            self.draw_sector_grid()
-            messagebox.showinfo('Added', f'Water block added to sector {self.current_sector}! Now adjust settings and Save.')
-        except Exception as e:
-            messagebox.showerror('Error', f'Failed to add water block: {e}')
+                write_csv(rows, path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror('Error', f'Failed to build report: {e}')
+            return
+        def sample(sectors):
+            return ', '.join(str(s) for s in sectors[:12]) + (' ...' if len(sectors) > 12 else '') if sectors else 'none'
+        heights = f"{summary['height_min']:g} – {summary['height_max']:g}" if summary['with_water'] else 'n/a'
+        messagebox.showinfo('Water Report', (
+            f"{summary['sectors']} sectors, {summary['with_water']} with water (heights {heights})\n\n"
+            f"Unknown material: {len(summary['unknown_material'])} ({sample(summary['unknown_material'])})\n"
+            f"Template mismatch: {len(summary['template_mismatch'])} ({sample(summary['template_mismatch'])})\n\n"
+            f"Saved to {os.path.basename(path)}"))
 
-    def save_current_sector(self):
-        if self.current_sector is None or self.sdat_folder is None:
-            messagebox.showwarning('No Sector', 'Select a sector first.')
+    def compare_folder(self):
+        # Lists sectors whose water header differs from another folder (the source) and
+        # copies the chosen ones into the loaded folder
+        if self.sdat_folder is None:
+            messagebox.showwarning('No Folder', 'Load an SDAT folder first.')
             return
-        target_path = os.path.join(self.sdat_folder, f'sd{self.current_sector}.csdat')
-        if not os.path.isfile(target_path):
-            messagebox.showerror('Missing file', f'{os.path.basename(target_path)} not found.')
+        source = filedialog.askdirectory(title='Select Folder To Compare With')
+        if not source or os.path.normcase(os.path.realpath(source)) == os.path.normcase(os.path.realpath(self.sdat_folder)):
             return
+        self.flush_writes()
+        try:
+            diffs, source_headers = compare_folders(source, self.sdat_folder)
+        except OSError as e:
+            messagebox.showerror('Error', f'Failed to compare folders: {e}')
+            return
+        if not diffs:
+            messagebox.showinfo('Compare', f'No water differences with {os.path.basename(source)}.')
+            return
+
+        def describe(side):
+            if side is None:
+                return 'missing'
+            if not side['has_water']:
+                return 'no water'
+            return f"{side['height']:.2f} {side['material'].rsplit(chr(92), 1)[-1]}"
+
+        window = tk.Toplevel(self.root)
+        window.title(f'Compare: {os.path.basename(source)} → {os.path.basename(self.sdat_folder)}')
+        window.configure(bg=self.colors['bg'])
+        ttk.Label(window, text=f'{len(diffs)} sectors differ (source → this folder)').pack(anchor='w', padx=10, pady=(10,4))
+        listbox = tk.Listbox(window, selectmode='extended', width=90, height=20, bg=self.colors['bg_tertiary'], fg=self.colors['text'], font=('Consolas', 9), relief='flat')
+        listbox.pack(fill='both', expand=True, padx=10)
+        for diff in diffs:
+            fields = ', '.join(diff['fields']) or diff['status'].replace('_', ' ')
+            listbox.insert('end', f"sd{diff['sector']:<6} {fields:<26} {describe(diff['source'])}  →  {describe(diff['dest'])}")
+        copyable = {diff['sector'] for diff in diffs if diff['status'] == 'changed'}
+
+        def chosen():
+            return [diffs[i]['sector'] for i in listbox.curselection()]
 
+        def select_on_map():
+            # With nothing picked in the list, every listed sector is selected
+            sectors = set(chosen() or [diff['sector'] for diff in diffs]) & self.sector_files
+            if sectors:
+                self.set_selection(sectors)
+
+        def copy_selected():
+            if not listbox.curselection():
+                messagebox.showwarning('Compare', 'Pick the sectors to copy in the list first, or use "Copy All From Source".', parent=window)
+                return
+            copy_sectors(chosen())
+
+        def copy_all():
+            if not messagebox.askyesno('Copy All', f'Copy the source water header over all {len(copyable)} differing sectors in {os.path.basename(self.sdat_folder)}?', parent=window):
+                return
+            copy_sectors(sorted(copyable))
+
+        def copy_sectors(sectors):
+            sectors = [s for s in sectors if s in copyable]
+            if not sectors:
+                messagebox.showwarning('Compare', 'None of the chosen sectors exist in both folders.', parent=window)
+                return
+            queued, skipped = self.apply_edits('sync_sectors', f'Copy from {os.path.basename(source)} to', lambda edits, i: edits.copy_water(i, source_headers[i]), sectors)
+            if self.current_sector in queued:
+                self.reload_after_write.add(self.current_sector)
+            self.report_skipped('Compare', skipped)
+            window.destroy()
+
+        buttons = ttk.Frame(window)
+        buttons.pack(fill='x', padx=10, pady=10)
+        ttk.Button(buttons, text="Select on Map", command=select_on_map).pack(side='left')
+        ttk.Button(buttons, text="Copy Selected From Source", command=copy_selected, style='Accent.TButton').pack(side='left', padx=(8,0))
+        ttk.Button(buttons, text="Copy All From Source", command=copy_all).pack(side='left', padx=(8,0))
+        ttk.Button(buttons, text="Close", command=window.destroy).pack(side='right')
+
+    def undo_edit(self):
+        self.step_history(undo=True)
+
+    def redo_edit(self):
+        self.step_history(undo=False)
+
+    def step_history(self, undo):
+        # Rolls the last edit back (or forward again) from the recorded byte deltas
+        self.flush_writes()
+        if self.history is None:
+            return
+        # Other tools may have recorded edits to the folder since the last look
+        self.history.sync()
+        if not (self.history.undo_stack if undo else self.history.redo_stack):
+            self.update_history_buttons()
+            return
+        label = (self.history.undo_stack if undo else self.history.redo_stack)[-1].label
         try:
-            with open(target_path, 'rb') as f:
-                target_data = bytearray(f.read())
+            changed = self.history.undo() if undo else self.history.redo()
+        except (OSError, ValueError) as e:
+            messagebox.showerror('Undo' if undo else 'Redo', f'Cannot {"undo" if undo else "redo"}: {e}')
+            return
+        for sector_index, (state, header) in changed.items():
+            self.index.store(sector_index, state, header)
+            self.scan_pending.discard(sector_index)
+        if self.current_sector in changed:
+            self.load_sector_into_ui(self.current_sector)
+        self.refresh_sectors(changed)
+        self.update_sector_info()
+        self.update_history_buttons()
+        self.status_label.config(text=f'{"↶ Undid" if undo else "↷ Redid"}: {label}', foreground=self.colors['success'])
 
-            # Write water height
-            if len(target_data) < WATER_HEIGHT_OFFSET + 4:
-                target_data.extend(b'\x00' * ((WATER_HEIGHT_OFFSET + 4) - len(target_data)))
-            height = float(self.height_entry_var.get())
-            target_data[WATER_HEIGHT_OFFSET:WATER_HEIGHT_OFFSET+4] = struct.pack('<f', height)
+    def update_history_buttons(self):
+        history = self.history
+        if history is None:
+            self.undo_btn.config(text="↶ Undo", state='disabled')
+            self.redo_btn.config(text="↷ Redo", state='disabled')
+            self.history_label.config(text='')
+            return
+        self.undo_btn.config(text=f"↶ Undo {history.undo_stack[-1].label}" if history.undo_stack else "↶ Undo", state='normal' if history.undo_stack else 'disabled')
+        self.redo_btn.config(text=f"↷ Redo {history.redo_stack[-1].label}" if history.redo_stack else "↷ Redo", state='normal' if history.redo_stack else 'disabled')
+        self.history_label.config(text=f'History: {len(history.undo_stack)} edits, {history.size() / 1024:.1f} KB')
 
-            # Write water path
-            max_len = WATER_PATH_MAX_OFFSET - WATER_PATH_OFFSET + 1
-            path = self.path_var.get()
-            if path in ('00', ''):
-                path_bytes = b'\x00' * max_len
-            else:
-                try:
-                    if path in WATER_PATHS_STR:
-                        idx = WATER_PATHS_STR.index(path)
-                        encoded = WATER_PATHS_BYTES[idx]
-                    else:
-                        encoded = path.encode('ascii', errors='ignore')
-                except:
-                    encoded = path.encode('ascii', errors='ignore')
-
-                if len(encoded) >= max_len:
-                    path_bytes = encoded[:max_len-1] + b'\x00'
-                else:
-                    path_bytes = encoded + b'\x00' + b'\x00' * (max_len - len(encoded) - 1)
+    def check_targets(self):
+        if not self.target_sectors() or self.sdat_folder is None:
+            messagebox.showwarning('No Sector', 'Select a sector first.')
+            return False
+        if len(self.selection) <= 1:
+            target_path = os.path.join(self.sdat_folder, f'sd{self.current_sector}.csdat')
+            exists = self.current_sector in self.archive if self.archive is not None else os.path.isfile(target_path)
+            if not exists:
+                messagebox.showerror('Missing file', f'{os.path.basename(target_path)} not found.')
+                return False
+        return True
+
+    def format_sector_list(self, items):
+        lines = [f'  sd{sector_index}: {reason}' for sector_index, reason in items[:10]]
+        if len(items) > 10:
+            lines.append(f'  ... and {len(items) - 10} more')
+        return '\n'.join(lines)
+
+    def report_skipped(self, title, skipped):
+        if skipped:
+            messagebox.showwarning(title, f'Skipped {len(skipped)} sectors:\n' + self.format_sector_list(skipped))
 
-            if len(target_data) < WATER_PATH_MAX_OFFSET + 1:
-                target_data.extend(b'\x00' * ((WATER_PATH_MAX_OFFSET + 1) - len(target_data)))
-            target_data[WATER_PATH_OFFSET:WATER_PATH_MAX_OFFSET+1] = path_bytes
+    def add_water_block(self):
+        if not self.check_targets():
+            return
+        try:
+            # Copy embedded template into every target, keeping each sector byte at 0x14
+            queued, skipped = self.apply_edits('add_water_block', 'Add water to', lambda edits, i: edits.add_template(i))
 
-            # Write FIX_BYTES at FIX_OFFSET_START
-            fix_end = FIX_OFFSET_START + len(FIX_BYTES)
-            if len(target_data) < fix_end:
-                target_data.extend(b'\x00' * (fix_end - len(target_data)))
-            target_data[FIX_OFFSET_START:fix_end] = FIX_BYTES
+            # Reload the sector once written to show the template's default values
+            if self.current_sector in queued:
+                self.reload_after_write.add(self.current_sector)
+            self.report_skipped('Add Water Block', skipped)
+        except Exception as e:
+            messagebox.showerror('Error', f'Failed to add water block: {e}')
 
-            with open(target_path, 'wb') as f:
-                f.write(target_data)
-                f.flush()
-                os.fsync(f.fileno())
+    def save_current_sector(self):
+        if not self.check_targets():
+            return
+        try:
+            # FIX_BYTES plus the ticked height/material fields are patched in place
+            height = None
+            if self.apply_height_var.get():
+                try:
+                    height = check_height(self.height_entry_var.get())
+                except ValueError:
+                    messagebox.showerror('Invalid Height', f'"{self.height_entry_var.get()}" is not a height the sector can store.')
+                    return
+            path = self.path_var.get() if self.apply_material_var.get() else None
+            queued, skipped = self.apply_edits('save_current_sector', 'Save', lambda edits, i: edits.set_water(i, height, path))
 
-            self.draw_sector_grid()
             self.update_sector_info()
-            messagebox.showinfo('Saved', f'Sector {self.current_sector} saved successfully!')
+            self.report_skipped('Save', skipped)
         except Exception as e:
             messagebox.showerror('Error', f'Failed to save: {e}')
 
     def reset_current_sector(self):
-        if self.current_sector is None or self.sdat_folder is None:
-            messagebox.showwarning('No Sector', 'Select a sector first.')
-            return
-        target_path = os.path.join(self.sdat_folder, f'sd{self.current_sector}.csdat')
-        if not os.path.isfile(target_path):
-            messagebox.showerror('Missing file', f'{os.path.basename(target_path)} not found.')
+        if not self.check_targets():
             return
         try:
-            with open(target_path, 'rb') as f:
-                data = bytearray(f.read())
-
-            # Reset height
-            if len(data) < WATER_HEIGHT_OFFSET + 4:
-                data.extend(b'\x00' * ((WATER_HEIGHT_OFFSET + 4) - len(data)))
-            data[WATER_HEIGHT_OFFSET:WATER_HEIGHT_OFFSET+4] = struct.pack('<f', 0.0)
-
-            # Reset path region
-            max_len = WATER_PATH_MAX_OFFSET - WATER_PATH_OFFSET + 1
-            if len(data) < WATER_PATH_MAX_OFFSET + 1:
-                data.extend(b'\x00' * ((WATER_PATH_MAX_OFFSET + 1) - len(data)))
-            data[WATER_PATH_OFFSET:WATER_PATH_MAX_OFFSET+1] = b'\x00' * max_len
-
-            # Write fix bytes
-            fix_end = FIX_OFFSET_START + len(FIX_BYTES)
-            if len(data) < fix_end:
-                data.extend(b'\x00' * (fix_end - len(data)))
-            data[FIX_OFFSET_START:fix_end] = FIX_BYTES
-
-            with open(target_path, 'wb') as f:
-                f.write(data)
-                f.flush()
-                os.fsync(f.fileno())
+            # Zero height and path region, rewrite fix bytes
+            queued, skipped = self.apply_edits('reset_current_sector', 'Reset', lambda edits, i: edits.reset(i))
 
-            self.load_sector_into_ui(self.current_sector)
-            self.draw_sector_grid()
-            messagebox.showinfo('Reset', f'Sector {self.current_sector} reset successfully!')
+            if self.current_sector in queued:
+                self.reload_after_write.add(self.current_sector)
+            self.report_skipped('Reset', skipped)
         except Exception as e:
             messagebox.showerror('Error', f'Failed to reset: {e}')
 
+    def set_selection(self, sectors, primary=None):
+        # Replaces the selection and restyles only the cells whose state changed
+        changed = self.selection.symmetric_difference(sectors) | {self.current_sector}
+        self.selection = set(sectors)
+        if primary not in self.selection:
+            primary = self.current_sector if self.current_sector in self.selection else min(self.selection, default=None)
+        if primary is not None and self.index.get(primary) is not None:
+            self.load_sector_into_ui(primary)
+        else:
+            self.current_sector = None
+        changed.add(self.current_sector)
+        self.update_sector_info()
+        self.refresh_sectors(changed)
+
     def select_sector(self, event):
         if self.sdat_folder is None:
             return
-        cell_size = 30
-        col = event.x // cell_size
-        row = event.y // cell_size
-        row = 15 - row
-        if col < 0 or col > 15 or row < 0 or row > 15:
+        sector_index = self.cell_at(event.x, event.y)
+        if sector_index is None:
             return
-        sector_index = row * 16 + col
-        file_path = os.path.join(self.sdat_folder, f'sd{sector_index}.csdat')
-        if os.path.isfile(file_path):
-            self.load_sector_into_ui(sector_index)
+        if sector_index in self.sector_files and self.index.get(sector_index) is not None:
+            self.set_selection({sector_index}, sector_index)
         else:
-            self.current_sector = None
-            self.update_sector_info()
-        self.draw_sector_grid()
+            self.set_selection(set())
+
+    def press_select(self, event):
+        self.drag_start = (event.x, event.y)
+        self.drag_extend = bool(event.state & 0x1)
+
+    def drag_select(self, event):
+        # Rubber band for rectangle selection
+        if self.drag_start is None or self.sdat_folder is None:
+            return
+        x0, y0 = self.drag_start
+        if self.band_item is None:
+            if abs(event.x - x0) < 4 and abs(event.y - y0) < 4:
+                return
+            self.band_item = self.grid_canvas.create_rectangle(x0, y0, event.x, event.y, outline=self.colors['accent'], dash=(4, 2), width=2)
+        self.grid_canvas.coords(self.band_item, x0, y0, event.x, event.y)
+
+    def release_select(self, event):
+        if self.drag_start is None:
+            return
+        start = self.drag_start
+        self.drag_start = None
+        if self.band_item is not None:
+            self.grid_canvas.delete(self.band_item)
+            self.band_item = None
+            sectors = self.sectors_in_rect(start[0], start[1], event.x, event.y)
+            if self.drag_extend:
+                sectors |= self.selection
+            self.set_selection(sectors, self.cell_at(event.x, event.y))
+        elif self.drag_extend:
+            self.toggle_sector(event)
+        else:
+            self.select_sector(event)
+
+    def toggle_sector(self, event):
+        # Shift-click adds a sector to the selection or removes it
+        if self.sdat_folder is None:
+            return
+        sector_index = self.cell_at(event.x, event.y)
+        if sector_index is None or sector_index not in self.sector_files:
+            return
+        if sector_index in self.selection:
+            self.set_selection(self.selection - {sector_index})
+        else:
+            self.set_selection(self.selection | {sector_index}, sector_index)
+
+    def flood_select(self, event):
+        # Double-click selects the connected region of sectors with the same water state
+        self.drag_start = None
+        if self.sdat_folder is None:
+            return
+        start = self.cell_at(event.x, event.y)
+        if start is None or start not in self.sector_files:
+            return
+        key = self.region_key(start)
+        region = {start}
+        stack = [start]
+        while stack:
+            row, col = divmod(stack.pop(), self.grid_cols)
+            for r, c in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+                if 0 <= r < self.grid_rows and 0 <= c < self.grid_cols:
+                    neighbour = r * self.grid_cols + c
+                    if neighbour not in region and neighbour in self.sector_files and self.region_key(neighbour) == key:
+                        region.add(neighbour)
+                        stack.append(neighbour)
+        if event.state & 0x1:
+            region |= self.selection
+        self.set_selection(region, start)
+
+    def region_key(self, sector_index):
+        # Dry sectors form one region; wet ones only join sectors with the same height and material
+        state = self.index.peek(sector_index) or self.index.get(sector_index)
+        if state is None or not state.has_water:
+            return None
+        return (state.height, state.path)
+
+    def sectors_in_rect(self, x0, y0, x1, y1):
+        # Existing sectors whose cells intersect the canvas rectangle (clamped to the world)
+        cell_size = self.cell_size
+        first_col, last_col = sorted(int((x + self.view_x) // cell_size) for x in (x0, x1))
+        first_line, last_line = sorted(int((y + self.view_y) // cell_size) for y in (y0, y1))
+        first_col, last_col = max(0, first_col), min(self.grid_cols - 1, last_col)
+        first_line, last_line = max(0, first_line), min(self.grid_rows - 1, last_line)
+        sectors = set()
+        for line in range(first_line, last_line + 1):
+            row = self.grid_rows - 1 - line
+            for col in range(first_col, last_col + 1):
+                sector_index = row * self.grid_cols + col
+                if sector_index in self.sector_files:
+                    sectors.add(sector_index)
+        return sectors
+
+    def toggle_diagnostics(self):
+        self.diag_visible = not self.diag_visible
+        if not self.diag_visible:
+            self.diag_frame.pack_forget()
+            self.diag_toggle_btn.config(text="▸ Diagnostics")
+        else:
+            self.diag_frame.pack(fill='both', expand=True, pady=(6,0), after=self.diag_toggle_btn)
+            self.diag_toggle_btn.config(text="▾ Diagnostics")
+            self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        # Re-renders the metrics table once a second while the panel is open
+        if self.diag_after is not None:
+            self.root.after_cancel(self.diag_after)
+            self.diag_after = None
+        if not self.diag_visible:
+            return
+        text = water_metrics.format_table()
+        if not water_metrics.ENABLED:
+            text = 'Recording is off.\n\n' + text
+        self.diag_text.config(state='normal')
+        self.diag_text.delete('1.0', 'end')
+        self.diag_text.insert('1.0', text)
+        self.diag_text.config(state='disabled')
+        self.diag_after = self.root.after(1000, self.refresh_diagnostics)
+
+    def toggle_metrics(self):
+        water_metrics.enable(self.diag_enabled_var.get())
+
+    def reset_metrics(self):
+        water_metrics.reset()
+        self.refresh_diagnostics()
+
+    def export_metrics(self):
+        path = filedialog.asksaveasfilename(title='Export Diagnostics', defaultextension='.json', filetypes=[('JSON', '*.json')])
+        if not path:
+            return
+        try:
+            water_metrics.dump(path)
+        except OSError as e:
+            messagebox.showerror('Error', f'Failed to export diagnostics: {e}')
 
     def update_sector_info(self):
-        if self.current_sector is None:
+        if len(self.selection) > 1:
+            wet = sum(1 for sector_index in self.selection if self.sector_has_water(sector_index))
+            self.sector_info.config(text=f'{len(self.selection)} sectors selected | 💧 {wet} with water')
+        elif self.current_sector is None:
             self.sector_info.config(text='Select a sector to edit')
         else:
             has_water = self.sector_has_water(self.current_sector)
@@ -0,0 +1,1215 @@
+# Sector file (.csdat) layout and header-window I/O shared by the editor and tools
+import contextlib
+import hashlib
+import json
+import math
+import os
+import queue
+import re
+import stat
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import water_metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Fixed offsets
+WATER_HEIGHT_OFFSET = 0xB0
+WATER_PATH_OFFSET = 0xB9
+WATER_PATH_MAX_OFFSET = 0x1BF
+FIX_BYTES = bytes.fromhex("C0E440FFFFFF")
+FIX_OFFSET_START = 0x21
+
+# Template copy range (inclusive start, exclusive end for python slicing)
+TEMPLATE_START = 0x00
+TEMPLATE_END = 0xF0  # 0x00..0xEF inclusive -> slice up to 0xF0
+
+# Embedded template data (240 bytes)
+EMBEDDED_TEMPLATE = bytes.fromhex(
+    "52 10 00 E9 09 00 00 00 64 5C 00 00 50 5C 00 00 00 00 00 00 21 00 00 00 00 00 00 00 00 00 00 00 00 C0 E4 40 FF FF FF 00 5C 59 00 00 04 00 00 00 01 00 00 00 00 61 6D 65 72 65 34 00 60 BC A9 0A 00 00 02 01 1D 64 E0 4F 15 00 00 00 60 A0 CE 34 60 A0 CE 34 00 00 00 00 E3 7B C2 94 2C FB 3F 0F 60 A0 CE 34 3C FB 3F 0F 00 00 00 00 00 00 00 00 D4 F9 3F 0F 10 EA E0 4F 40 00 00 00 00 00 00 00 20 60 CE 34 00 00 00 00 E8 30 CF 34 08 8D A9 0A 01 00 00 00 B8 21 0F 40 8C FB 3F 0F 00 00 00 00 00 00 48 43 00 00 80 C0 01 00 00 00 00 00 00 00 00 00 00 3F 00 00 00 00 00 67 72 61 70 68 69 63 73 5C 5F 6D 61 74 65 72 69 61 6C 73 5C 65 64 69 74 6F 72 5C 77 61 74 65 72 5F 61 76 5F 72 61 69 6E 66 6F 72 65 73 74 2E 6D 6C 6D 00 00 00 00 00"
+)
+
+# Water file paths (displayed strings; bytes are written with single backslashes)
+WATER_PATHS_BYTES = [
+    b"graphics\\_materials\\editor\\df_water_default_top.mlm",
+    b"graphics\\_materials\\editor\\water_av_openfield.mlm",
+    b"graphics\\_materials\\editor\\water_av_rainforest.mlm",
+    b"graphics\\_materials\\editor\\water_av_rainforest_prolemuris_noreflection.mlm",
+    b"graphics\\_materials\\editor\\water_av_riverbank.mlm",
+    b"graphics\\_materials\\editor\\water_av_swamp.mlm",
+]
+
+WATER_PATHS_STR = [p.decode('ascii') for p in WATER_PATHS_BYTES]
+
+# Every water field lives in the first HEADER_SIZE bytes of a sector file
+HEADER_SIZE = max(WATER_PATH_MAX_OFFSET + 1, TEMPLATE_END, FIX_OFFSET_START + len(FIX_BYTES))
+
+def read_header(file_path, size=HEADER_SIZE):
+    # Unbuffered fixed-size read: cost is bounded by the header window, not the file size
+    chunks = []
+    remaining = size
+    with open(file_path, 'rb', buffering=0) as f:
+        while remaining > 0:
+            chunk = f.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+    header = b''.join(chunks)
+    if water_metrics.ENABLED:
+        water_metrics.count_io(bytes_read=len(header))
+    return header
+
+def read_headers(paths, workers=1):
+    # Reads the header windows of many files straight into one zero-padded buffer of
+    # HEADER_SIZE bytes per file. Returns (bytearray, sizes) with sizes[i] the bytes
+    # read, or -1 when paths[i] is unreadable. workers > 1 overlaps the reads on a thread
+    # pool, which pays off on network or cold storage but not on a warm local cache.
+    buffer = bytearray(len(paths) * HEADER_SIZE)
+    view = memoryview(buffer)
+    sizes = [-1] * len(paths)
+
+    def read_into(i):
+        slot = view[i * HEADER_SIZE:(i + 1) * HEADER_SIZE]
+        got = 0
+        try:
+            with open(paths[i], 'rb', buffering=0) as f:
+                while got < HEADER_SIZE:
+                    n = f.readinto(slot[got:])
+                    if not n:
+                        break
+                    got += n
+        except OSError:
+            return
+        sizes[i] = got
+        if water_metrics.ENABLED:
+            water_metrics.count_io(bytes_read=got)
+
+    if not workers or workers <= 1 or len(paths) <= 1:
+        for i in range(len(paths)):
+            read_into(i)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(read_into, range(len(paths))):
+                pass
+    return buffer, sizes
+
+# Decoded water fields of one sector; path is '00' when no material is set
+WaterState = namedtuple('WaterState', ['height', 'path', 'has_water'])
+NO_WATER = WaterState(0.0, '00', False)
+
+def decode_water_state(data):
+    return SectorHeader(data).state()
+
+SECTOR_FILE_RE = re.compile(r'^sd(\d+)\.csdat$', re.IGNORECASE)
+
+def sector_file_name(sector_index):
+    return f'sd{sector_index}.csdat'
+
+def list_sectors(folder):
+    # Sorted indices of the sd{N}.csdat files present in folder
+    sectors = []
+    for entry in os.scandir(folder):
+        match = SECTOR_FILE_RE.match(entry.name)
+        if match and entry.is_file():
+            sectors.append(int(match.group(1)))
+    return sorted(sectors)
+
+def read_water_state(file_path):
+    return decode_water_state(read_header(file_path))
+
+WATER_PATH_LEN = WATER_PATH_MAX_OFFSET - WATER_PATH_OFFSET + 1
+SECTOR_BYTE_OFFSET = 0x14
+
+# Template bytes that should match EMBEDDED_TEMPLATE in a water sector: everything but the
+# sector byte, the height and the material path, which differ per sector
+TEMPLATE_MASK = bytearray(b'\x01' * TEMPLATE_END)
+TEMPLATE_MASK[SECTOR_BYTE_OFFSET] = 0
+TEMPLATE_MASK[WATER_HEIGHT_OFFSET:WATER_HEIGHT_OFFSET + 4] = bytes(4)
+TEMPLATE_MASK[WATER_PATH_OFFSET:TEMPLATE_END] = bytes(TEMPLATE_END - WATER_PATH_OFFSET)
+
+def encode_water_path(path):
+    if path in ('00', ''):
+        return b'\x00' * WATER_PATH_LEN
+    if path in WATER_PATHS_STR:
+        encoded = WATER_PATHS_BYTES[WATER_PATHS_STR.index(path)]
+    else:
+        encoded = path.encode('ascii', errors='ignore')
+    if len(encoded) >= WATER_PATH_LEN:
+        return encoded[:WATER_PATH_LEN-1] + b'\x00'
+    return encoded.ljust(WATER_PATH_LEN, b'\x00')
+
+# Precompiled layouts of the water fields inside the header window
+HEIGHT_STRUCT = struct.Struct('<f')
+FIX_STRUCT = struct.Struct(f'{len(FIX_BYTES)}s')
+SECTOR_BYTE_STRUCT = struct.Struct('B')
+WATER_PATH_STRUCT = struct.Struct(f'{WATER_PATH_LEN}s')
+# Largest finite value the float32 height field can hold
+MAX_HEIGHT = struct.unpack('<f', b'\xff\xff\x7f\x7f')[0]
+
+def check_height(value):
+    # Returns value as a float, or raises ValueError if the height field cannot store it
+    height = float(value)
+    if not math.isfinite(height) or abs(height) > MAX_HEIGHT:
+        raise ValueError(f'height {value} does not fit a 32-bit float')
+    return height
+
+class SectorHeader:
+    # Field access over a memoryview of a sector header window. Wrapping bytes gives a
+    # read-only view; editable() wraps a zero-padded HEADER_SIZE bytearray. size is how
+    # many window bytes the file has; writing a field past it grows size, and the file
+    # is extended with zeros when that range is committed.
+    __slots__ = ('view', 'size')
+
+    def __init__(self, buffer, size=None):
+        # buffer is bytes, a bytearray or a memoryview slice starting at file offset 0
+        self.view = memoryview(buffer)
+        self.size = len(buffer) if size is None else size
+
+    @classmethod
+    def editable(cls, data):
+        size = min(len(data), HEADER_SIZE)
+        buf = bytearray(HEADER_SIZE)
+        buf[:size] = data[:size]
+        return cls(buf, size)
+
+    def _grow(self, end):
+        if self.size < end:
+            self.size = end
+
+    @property
+    def height(self):
+        if self.size < WATER_HEIGHT_OFFSET + HEIGHT_STRUCT.size:
+            return 0.0
+        return HEIGHT_STRUCT.unpack_from(self.view, WATER_HEIGHT_OFFSET)[0]
+
+    @height.setter
+    def height(self, value):
+        HEIGHT_STRUCT.pack_into(self.view, WATER_HEIGHT_OFFSET, check_height(value))
+        self._grow(WATER_HEIGHT_OFFSET + HEIGHT_STRUCT.size)
+
+    @property
+    def path(self):
+        # NUL-terminated ASCII material path, '00' when empty
+        end = min(self.size, WATER_PATH_OFFSET + WATER_PATH_LEN)
+        raw = self.view[WATER_PATH_OFFSET:end].tobytes()
+        nul = raw.find(b'\x00')
+        return str(raw if nul < 0 else raw[:nul], 'ascii', 'ignore').strip() or '00'
+
+    @path.setter
+    def path(self, value):
+        WATER_PATH_STRUCT.pack_into(self.view, WATER_PATH_OFFSET, encode_water_path(value))
+        self._grow(WATER_PATH_OFFSET + WATER_PATH_LEN)
+
+    @property
+    def path_bytes(self):
+        if self.size < WATER_PATH_OFFSET + WATER_PATH_LEN:
+            return bytes(self.view[WATER_PATH_OFFSET:max(self.size, WATER_PATH_OFFSET)])
+        return WATER_PATH_STRUCT.unpack_from(self.view, WATER_PATH_OFFSET)[0]
+
+    @property
+    def fix_bytes(self):
+        if self.size < FIX_OFFSET_START + FIX_STRUCT.size:
+            return None
+        return FIX_STRUCT.unpack_from(self.view, FIX_OFFSET_START)[0]
+
+    @fix_bytes.setter
+    def fix_bytes(self, value):
+        FIX_STRUCT.pack_into(self.view, FIX_OFFSET_START, value)
+        self._grow(FIX_OFFSET_START + FIX_STRUCT.size)
+
+    @property
+    def sector_byte(self):
+        if self.size <= SECTOR_BYTE_OFFSET:
+            return None
+        return SECTOR_BYTE_STRUCT.unpack_from(self.view, SECTOR_BYTE_OFFSET)[0]
+
+    @sector_byte.setter
+    def sector_byte(self, value):
+        SECTOR_BYTE_STRUCT.pack_into(self.view, SECTOR_BYTE_OFFSET, value & 0xFF)
+        self._grow(SECTOR_BYTE_OFFSET + 1)
+
+    def copy_template(self, sector_index):
+        # Copy the embedded template, keeping the sector's own byte at 0x14
+        sector_byte = self.sector_byte
+        self.view[TEMPLATE_START:TEMPLATE_END] = EMBEDDED_TEMPLATE
+        self._grow(TEMPLATE_END)
+        self.sector_byte = sector_index if sector_byte is None else sector_byte
+
+    def copy_water_from(self, other):
+        # Copy another sector's header window (template, height, path), keeping this
+        # sector's own byte at 0x14 like copy_template does; returns the copied length
+        sector_byte = self.sector_byte
+        # Bytes past a short source window are copied as zeros, so both windows end equal
+        size = min(max(other.size, self.size), HEADER_SIZE)
+        self.view[:size] = other.view[:size].tobytes().ljust(size, b'\x00')
+        self._grow(size)
+        if sector_byte is not None:
+            self.sector_byte = sector_byte
+        return size
+
+    def state(self):
+        if self.size < WATER_HEIGHT_OFFSET + HEIGHT_STRUCT.size:
+            return NO_WATER
+        height = self.height
+        path = self.path
+        return WaterState(height, path, (abs(height) > 1e-6) or path != '00')
+
+    def tobytes(self):
+        return self.view[:self.size].tobytes()
+
+# Advisory locks between processes working on the same folder: flock() on POSIX, and on
+# Windows a one-byte msvcrt lock far past the data (a locked range cannot be read there)
+LOCK_OFFSET = 0x7FFFFFFE
+
+def _lock_file(f, blocking=True):
+    # Locks the open file f; False when blocking is off and someone else holds the lock
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+    pos = f.tell()
+    f.seek(LOCK_OFFSET)
+    try:
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.05)
+    finally:
+        f.seek(pos)
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return
+    pos = f.tell()
+    f.seek(LOCK_OFFSET)
+    try:
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        f.seek(pos)
+
+# Intent journal: patches are made durable in a checksummed journal next to the
+# sectors before any sector byte is touched, and rolled forward on recovery, so
+# an interrupted write never leaves a half-patched or truncated sector. The journal
+# also holds the bytes every patch replaces and each file's size: when a write fails
+# while the writer is still running, the journal's direction byte is flipped and the
+# old bytes are put back, so a failed commit leaves neither changed sectors nor an
+# intent that a later recovery would replay. The writer keeps its journal locked for
+# the journal's whole lifetime, and recovery skips journals that are still locked.
+JOURNAL_MAGIC = b'CSWJ\x02'
+JOURNAL_MAGIC_V1 = b'CSWJ\x01'
+JOURNAL_FORWARD = b'F'
+JOURNAL_ROLLBACK = b'R'
+JOURNAL_PREFIX = '.water-'
+JOURNAL_SUFFIX = '.journal'
+
+def _encode_journal(entries):
+    # entries is {name: (file size, [(offset, new bytes, old bytes)])}
+    parts = [struct.pack('<I', len(entries))]
+    for name, (size, patches) in entries.items():
+        encoded_name = name.encode('utf-8')
+        parts.append(struct.pack('<HII', len(encoded_name), size, len(patches)))
+        parts.append(encoded_name)
+        for offset, chunk, old in patches:
+            parts.append(struct.pack('<II', offset, len(chunk)))
+            parts.append(chunk)
+            parts.append(old)
+    body = b''.join(parts)
+    return JOURNAL_MAGIC + JOURNAL_FORWARD + struct.pack('<I', zlib.crc32(body)) + body
+
+def _decode_journal_v1(body):
+    # Journals written before old bytes were kept can only be rolled forward
+    entries = {}
+    pos = 4
+    for _ in range(struct.unpack_from('<I', body)[0]):
+        name_len, offset, size = struct.unpack_from('<HII', body, pos)
+        pos += 10
+        name = body[pos:pos+name_len].decode('utf-8')
+        pos += name_len
+        entries.setdefault(name, (None, []))[1].append((offset, body[pos:pos+size], None))
+        pos += size
+    return JOURNAL_FORWARD, entries
+
+def _decode_journal(data):
+    # Returns (direction, entries), or None for a torn or foreign journal
+    if data.startswith(JOURNAL_MAGIC_V1):
+        direction, head = JOURNAL_FORWARD, len(JOURNAL_MAGIC_V1)
+    elif data.startswith(JOURNAL_MAGIC):
+        direction, head = data[len(JOURNAL_MAGIC):len(JOURNAL_MAGIC) + 1], len(JOURNAL_MAGIC) + 1
+    else:
+        return None
+    body = data[head + 4:]
+    if len(body) < 4 or struct.unpack('<I', data[head:head + 4])[0] != zlib.crc32(body):
+        return None
+    try:
+        if head == len(JOURNAL_MAGIC_V1):
+            return _decode_journal_v1(body)
+        entries = {}
+        pos = 4
+        for _ in range(struct.unpack_from('<I', body)[0]):
+            name_len, size, count = struct.unpack_from('<HII', body, pos)
+            pos += 10
+            name = body[pos:pos+name_len].decode('utf-8')
+            pos += name_len
+            patches = []
+            for _ in range(count):
+                offset, length = struct.unpack_from('<II', body, pos)
+                pos += 8
+                patches.append((offset, body[pos:pos+length], body[pos+length:pos+2*length]))
+                pos += 2 * length
+            entries[name] = (size, patches)
+    except (struct.error, UnicodeDecodeError):
+        return None
+    return direction, entries
+
+def _fsync_dir(folder):
+    # Make journal creation/removal durable; directories can't be opened on Windows
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+        if water_metrics.ENABLED:
+            water_metrics.count_io(fsyncs=1)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# Files written in one commit are fsynced together after all their writes are issued,
+# FSYNC_GROUP open files at a time, so the OS can merge the writeback
+FSYNC_GROUP = 64
+
+def _sync_group(files):
+    try:
+        for f in files:
+            f.flush()
+            os.fsync(f.fileno())
+        if water_metrics.ENABLED:
+            water_metrics.count_io(fsyncs=len(files))
+    finally:
+        for f in files:
+            f.close()
+        files.clear()
+
+def _write_patches(folder, file_patches, sizes=None, started=None):
+    # Writes {name: patches}, then truncates the files named in sizes; each name is
+    # appended to started before its first byte is written
+    pending = []
+    try:
+        for name, patches in file_patches.items():
+            f = open(os.path.join(folder, name), 'r+b')
+            pending.append(f)
+            if started is not None:
+                started.append(name)
+            for offset, chunk in patches:
+                f.seek(offset)
+                f.write(chunk)
+            if sizes and name in sizes:
+                f.truncate(sizes[name])
+            if water_metrics.ENABLED:
+                water_metrics.count_io(bytes_written=sum(len(chunk) for _, chunk in patches))
+            if len(pending) >= FSYNC_GROUP:
+                _sync_group(pending)
+    finally:
+        _sync_group(pending)
+
+def _roll_forward(folder, entries, started=None):
+    _write_patches(folder, {name: [(offset, chunk) for offset, chunk, _ in patches] for name, (_, patches) in entries.items()}, started=started)
+
+def _roll_back(folder, entries):
+    # Puts the old bytes back and truncates files the patches had extended
+    sizes = {
+        name: size for name, (size, patches) in entries.items()
+        if any(offset + len(chunk) > size for offset, chunk, _ in patches)
+    }
+    _write_patches(folder, {name: [(offset, old) for offset, _, old in patches] for name, (_, patches) in entries.items()}, sizes)
+
+def _journal_entries(folder, file_patches):
+    # Opens every target for writing before anything is written, so a missing or
+    # read-only sector fails the commit up front, and reads the bytes each patch replaces
+    entries = {}
+    for name, patches in file_patches.items():
+        with open(os.path.join(folder, name), 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            items = []
+            for offset, chunk in patches:
+                f.seek(offset)
+                items.append((offset, chunk, f.read(len(chunk)).ljust(len(chunk), b'\x00')))
+        if water_metrics.ENABLED:
+            water_metrics.count_io(bytes_read=sum(max(0, min(len(chunk), size - offset)) for offset, chunk in patches))
+        entries[name] = (size, items)
+    return entries
+
+def _remove_journal(j, journal_path):
+    # On POSIX the journal is unlinked while still locked; Windows cannot delete an open
+    # file, so there it is unlocked and closed first
+    try:
+        try:
+            os.remove(journal_path)
+        except PermissionError:
+            _unlock_file(j)
+            j.close()
+            os.remove(journal_path)
+    except FileNotFoundError:
+        pass
+
+@water_metrics.timed('patch_files')
+def patch_files(folder, file_patches):
+    # Apply {sector file name: patches} for files in one folder as a single journaled
+    # commit. Either every patch lands, or the commit raises with every file unchanged.
+    file_patches = {name: patches for name, patches in file_patches.items() if patches}
+    if not file_patches:
+        return
+    entries = _journal_entries(folder, file_patches)
+    journal_path = os.path.join(folder, f'{JOURNAL_PREFIX}{os.getpid()}-{threading.get_ident()}{JOURNAL_SUFFIX}')
+    journal = _encode_journal(entries)
+    with open(journal_path, 'w+b') as j:
+        _lock_file(j)
+        j.write(journal)
+        j.flush()
+        os.fsync(j.fileno())
+        if water_metrics.ENABLED:
+            water_metrics.count_io(bytes_written=len(journal), fsyncs=1)
+        _fsync_dir(folder)
+        started = []
+        try:
+            _roll_forward(folder, entries, started)
+        except BaseException:
+            # From here on a crash rolls back as well
+            j.seek(len(JOURNAL_MAGIC))
+            j.write(JOURNAL_ROLLBACK)
+            j.flush()
+            os.fsync(j.fileno())
+            _roll_back(folder, {name: entries[name] for name in started})
+            _remove_journal(j, journal_path)
+            raise
+        _remove_journal(j, journal_path)
+
+def patch_file(file_path, patches):
+    folder, name = os.path.split(file_path)
+    patch_files(folder or '.', {name: patches})
+
+def recover_journals(folder):
+    # Finish commits whose writer died: roll a journal forward, or back when its
+    # writer had started a rollback. Journals still locked by a live writer (in this or
+    # another process) are left alone. Returns the number of journals replayed.
+    try:
+        names = [n for n in os.listdir(folder) if n.startswith(JOURNAL_PREFIX) and n.endswith(JOURNAL_SUFFIX)]
+    except OSError:
+        return 0
+    replayed = 0
+    for name in names:
+        journal_path = os.path.join(folder, name)
+        try:
+            j = open(journal_path, 'rb')
+        except OSError:
+            continue
+        with j:
+            if not _lock_file(j, blocking=False):
+                continue
+            decoded = _decode_journal(j.read())
+            if decoded is not None:
+                direction, entries = decoded
+                entries = {n: e for n, e in entries.items() if os.path.isfile(os.path.join(folder, n))}
+                if direction == JOURNAL_ROLLBACK:
+                    _roll_back(folder, entries)
+                else:
+                    _roll_forward(folder, entries)
+                replayed += 1
+            try:
+                _remove_journal(j, journal_path)
+            except OSError:
+                pass
+    if names:
+        _fsync_dir(folder)
+    return replayed
+
+# Sector summaries persist across sessions in a JSON sidecar next to the sectors, or in
+# the per-user cache directory when the folder is read-only. Entries are trusted only
+# while the file's size and mtime_ns still match, so a stale or corrupt cache costs a
+# re-read. Water edits never change a file's size, and a file written again within the
+# filesystem's mtime granularity (2 s on FAT/exFAT) after it was read keeps its mtime
+# too; so, as git does for its index, an entry read less than RACY_NS after the file's
+# mtime is racy: it is stored without the mtime, never matches a stat key, and is read
+# again (its digest compared) on every lookup until the file is old enough.
+CACHE_FILE_NAME = '.water_cache.json'
+CACHE_VERSION = 1
+RACY_NS = 3 * 10**9
+
+def _settled_key(key, read_ns):
+    # The stat key to cache for a file whose header was read at (or after) read_ns
+    if key is not None and key[1] > read_ns - RACY_NS:
+        return (key[0], None)
+    return key
+
+def header_digest(header):
+    return hashlib.blake2b(header, digest_size=8).hexdigest()
+
+def user_cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'AvatarWaterEditor')
+
+class SectorIndex:
+    # Per-folder cache of decoded sector water state, keyed by os.stat size and mtime.
+    # Entries are only re-decoded when the file changed on disk or is still racy.
+    def __init__(self, folder, use_cache=True):
+        self.folder = folder
+        self.use_cache = use_cache
+        self._entries = {}
+        self._dirty = False
+        if use_cache:
+            self.load_cache()
+
+    def sector_path(self, sector_index):
+        return os.path.join(self.folder, sector_file_name(sector_index))
+
+    def _stat_key(self, sector_index):
+        try:
+            st = os.stat(self.sector_path(sector_index))
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def read(self, sector_index, key=None):
+        # Stats and decodes one sector without touching the cache, so it is safe to call
+        # from a worker thread. Returns (stat key, WaterState, header digest); the state
+        # is None when the file does not exist and the key is None when the result must
+        # not be cached.
+        read_ns = time.time_ns()
+        if key is None:
+            key = self._stat_key(sector_index)
+            if key is None:
+                return None, None, None
+        try:
+            header = read_header(self.sector_path(sector_index))
+        except OSError:
+            return None, NO_WATER, None
+        return _settled_key(key, read_ns), decode_water_state(header), header_digest(header)
+
+    def snapshot(self):
+        return dict(self._entries)
+
+    def scan(self, sector_index, known):
+        # Like read(), but reuses an entry of a snapshot() whose stat key still matches
+        key = self._stat_key(sector_index)
+        if key is None:
+            return None, None, None
+        entry = known.get(sector_index)
+        if entry is not None and entry[0] == key:
+            return entry
+        return self.read(sector_index, key)
+
+    def put(self, sector_index, key, state, digest=None):
+        if state is None:
+            if self._entries.pop(sector_index, None) is not None:
+                self._dirty = True
+        elif key is not None and self._entries.get(sector_index) != (key, state, digest):
+            self._entries[sector_index] = (key, state, digest)
+            self._dirty = True
+
+    def get(self, sector_index):
+        # Returns the sector's WaterState, or None when sd{N}.csdat does not exist
+        key = self._stat_key(sector_index)
+        if key is None:
+            self.put(sector_index, None, None)
+            return None
+        entry = self._entries.get(sector_index)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        key, state, digest = self.read(sector_index, key)
+        self.put(sector_index, key, state, digest)
+        return state
+
+    def refresh(self, sector_index):
+        # Re-decodes the sector only when its size or mtime moved; True if the entry changed
+        key = self._stat_key(sector_index)
+        entry = self._entries.get(sector_index)
+        if entry is not None and entry[0] == key:
+            return False
+        if key is None:
+            self.put(sector_index, None, None)
+            return entry is not None
+        key, state, digest = self.read(sector_index, key)
+        self.put(sector_index, key, state, digest)
+        return entry is None or entry[1:] != (state, digest)
+
+    def peek(self, sector_index):
+        # Last known state without touching the disk; None when not indexed yet
+        entry = self._entries.get(sector_index)
+        return entry[1] if entry is not None else None
+
+    def store(self, sector_index, state, header=None):
+        # Record the state the editor just wrote; while the file is this fresh the entry
+        # is racy, so lookups still re-read the header until it settles
+        written_ns = time.time_ns()
+        key = _settled_key(self._stat_key(sector_index), written_ns)
+        self.put(sector_index, key, state if key is not None else None, header_digest(header) if header is not None else None)
+
+    def cache_paths(self):
+        folder_key = hashlib.sha1(os.path.normcase(os.path.realpath(self.folder)).encode('utf-8')).hexdigest()[:16]
+        return [os.path.join(self.folder, CACHE_FILE_NAME), os.path.join(user_cache_dir(), f'{folder_key}.json')]
+
+    def load_cache(self):
+        for path in self.cache_paths():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entries = _parse_cache(json.load(f))
+            except (OSError, ValueError):
+                continue
+            if entries is not None:
+                self._entries.update(entries)
+                return True
+        return False
+
+    def save_cache(self):
+        # Returns the path written, or None when nothing changed or no location is writable
+        if not self.use_cache or not self._dirty:
+            return None
+        text = json.dumps({
+            'version': CACHE_VERSION,
+            'sectors': {
+                str(sector_index): [key[0], key[1], digest, state.height, state.path, state.has_water]
+                for sector_index, (key, state, digest) in sorted(self._entries.items()) if key[1] is not None
+            },
+        }, separators=(',', ':'))
+        for path in self.cache_paths():
+            tmp_path = path + '.tmp'
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, path)
+            except OSError:
+                continue
+            self._dirty = False
+            return path
+        return None
+
+    def clear_cache(self):
+        # Forget every entry and delete the persisted summaries
+        self._entries.clear()
+        self._dirty = False
+        for path in self.cache_paths():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _parse_cache(data):
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION or not isinstance(data.get('sectors'), dict):
+        return None
+    entries = {}
+    for name, row in data['sectors'].items():
+        try:
+            size, mtime_ns, digest, height, path, has_water = row
+            entries[int(name)] = ((int(size), int(mtime_ns)), WaterState(float(height), str(path), bool(has_water)), digest if isinstance(digest, str) else None)
+        except (TypeError, ValueError):
+            continue
+    return entries
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def _changed_span(before, after):
+    # (start, end) of the bytes that differ between two equal-length chunks
+    start = 0
+    end = len(before)
+    while start < end and before[start] == after[start]:
+        start += 1
+    while end > start and before[end - 1] == after[end - 1]:
+        end -= 1
+    return start, end
+
+class SectorEdits:
+    # Pending add/save/reset edits for sectors of one folder. Each sector header is read
+    # once, edits are applied in order in memory, and commit() writes only the touched
+    # ranges of every file as a single journaled patch. With an EditHistory, each commit
+    # also records the before/after bytes it changed for undo.
+    def __init__(self, folder, history=None):
+        self.folder = folder
+        self.history = history
+        self._headers = {}
+        self._original = {}
+        self._sizes = {}
+        self._ranges = {}
+        self._sectors = {}
+
+    def _read(self, sector_index):
+        return read_header(os.path.join(self.folder, sector_file_name(sector_index)))
+
+    def _load(self, sector_index):
+        name = sector_file_name(sector_index)
+        if name not in self._headers:
+            header = SectorHeader.editable(self._read(sector_index))
+            self._headers[name] = header
+            self._original[name] = header.view.tobytes()
+            self._sizes[name] = header.size
+            self._ranges[name] = []
+            self._sectors[name] = sector_index
+        return name, self._headers[name]
+
+    def add_template(self, sector_index):
+        name, header = self._load(sector_index)
+        header.copy_template(sector_index)
+        self._ranges[name].append((TEMPLATE_START, TEMPLATE_END))
+
+    def copy_water(self, sector_index, source):
+        # Take the water setup of `source` (a SectorHeader from another folder)
+        name, header = self._load(sector_index)
+        self._ranges[name].append((0, header.copy_water_from(source)))
+
+    def set_water(self, sector_index, height=None, path=None):
+        # Save semantics: FIX_BYTES are always rewritten, height and path only when given
+        name, header = self._load(sector_index)
+        ranges = self._ranges[name]
+        header.fix_bytes = FIX_BYTES
+        ranges.append((FIX_OFFSET_START, FIX_OFFSET_START + FIX_STRUCT.size))
+        if height is not None:
+            header.height = height
+            ranges.append((WATER_HEIGHT_OFFSET, WATER_HEIGHT_OFFSET + HEIGHT_STRUCT.size))
+        if path is not None:
+            header.path = path
+            ranges.append((WATER_PATH_OFFSET, WATER_PATH_OFFSET + WATER_PATH_LEN))
+
+    def reset(self, sector_index):
+        self.set_water(sector_index, 0.0, '00')
+
+    def discard(self, sector_index):
+        # Drop a sector's uncommitted edits (e.g. after one of them failed half way)
+        name = sector_file_name(sector_index)
+        for table in (self._headers, self._original, self._sizes, self._ranges, self._sectors):
+            table.pop(name, None)
+
+    def state(self, sector_index):
+        return self._load(sector_index)[1].state()
+
+    def patches(self):
+        return {
+            name: [(start, self._headers[name].view[start:end].tobytes()) for start, end in _merge_ranges(ranges)]
+            for name, ranges in self._ranges.items()
+        }
+
+    def deltas(self):
+        # {name: [(offset, before, after)]} trimmed to the bytes the pending edits change
+        deltas = {}
+        for name, ranges in self._ranges.items():
+            original = self._original[name]
+            view = self._headers[name].view
+            for start, end in _merge_ranges(ranges):
+                before = original[start:end]
+                after = view[start:end].tobytes()
+                lo, hi = _changed_span(before, after)
+                if lo < hi:
+                    deltas.setdefault(name, []).append((start + lo, before[lo:hi], after[lo:hi]))
+        return deltas
+
+    def sizes(self):
+        # {name: (size before, size after)} for files shorter than the header window
+        # that the pending edits extend
+        return {
+            name: (self._sizes[name], self._headers[name].size)
+            for name, ranges in self._ranges.items() if ranges and self._headers[name].size != self._sizes[name]
+        }
+
+    def header(self, sector_index):
+        # The sector's header window with all edits applied (as on disk after commit)
+        return self._load(sector_index)[1].tobytes()
+
+    def commit(self, label=None):
+        # Returns {sector index: WaterState} for every edited sector
+        deltas = self.deltas() if self.history is not None else None
+        sizes = self.sizes() if self.history is not None else None
+        patch_files(self.folder, self.patches())
+        for name, ranges in self._ranges.items():
+            if ranges:
+                self._original[name] = self._headers[name].view.tobytes()
+                self._sizes[name] = self._headers[name].size
+                ranges.clear()
+        if deltas or sizes:
+            self.history.record(label or 'Edit', deltas, sizes)
+        return {self._sectors[name]: header.state() for name, header in self._headers.items()}
+
+# Undo/redo history: an append-only file next to the sectors holding one CRC-checked
+# record per commit with only the bytes it changed (before and after), plus undo/redo
+# markers. Replaying the file rebuilds both stacks; a torn tail record is dropped.
+# Edits that extend a short sector file also record its size before and after, in a
+# trailer after the byte deltas, so undo can truncate the file back.
+# The editor and the command-line tools append to the same file, so every edit record
+# carries a sequence number and the undo/redo markers name the edit they apply to.
+# Writers hold a lock on the file and catch up with what others appended before they
+# append themselves.
+HISTORY_FILE_NAME = '.water_history'
+HISTORY_MAGIC = b'CSWS'
+# First-format records have no sequence numbers; their markers apply to the newest edit
+HISTORY_MAGIC_V1 = b'CSWH'
+HISTORY_EDIT = 0
+HISTORY_UNDO = 1
+HISTORY_REDO = 2
+HISTORY_HEAD = struct.Struct('<BdHI')
+HISTORY_SEQ = struct.Struct('<Q')
+
+HistoryEntry = namedtuple('HistoryEntry', 'label timestamp deltas sizes seq')
+
+def _encode_history_record(kind, seq, timestamp, label='', deltas=None, sizes=None):
+    # seq is the edit's own number for HISTORY_EDIT, else the number of the edit undone/redone
+    encoded_label = label.encode('utf-8')[:0xFFFF]
+    items = [(name, delta) for name, name_deltas in (deltas or {}).items() for delta in name_deltas]
+    parts = [HISTORY_SEQ.pack(seq), HISTORY_HEAD.pack(kind, timestamp, len(encoded_label), len(items)), encoded_label]
+    for name, (offset, before, after) in items:
+        encoded_name = name.encode('utf-8')
+        parts.append(struct.pack('<HII', len(encoded_name), offset, len(before)))
+        parts.append(encoded_name)
+        parts.append(before)
+        parts.append(after)
+    if sizes:
+        parts.append(struct.pack('<I', len(sizes)))
+        for name, (size_before, size_after) in sizes.items():
+            encoded_name = name.encode('utf-8')
+            parts.append(struct.pack('<HII', len(encoded_name), size_before, size_after))
+            parts.append(encoded_name)
+    body = b''.join(parts)
+    return HISTORY_MAGIC + struct.pack('<II', len(body), zlib.crc32(body)) + body
+
+def _decode_history(data):
+    # Yields (end offset, kind, seq, HistoryEntry or None) for each intact record; seq
+    # is None for first-format records
+    pos = 0
+    head = len(HISTORY_MAGIC) + 8
+    while pos + head <= len(data) and data[pos:pos + len(HISTORY_MAGIC)] in (HISTORY_MAGIC, HISTORY_MAGIC_V1):
+        size, crc = struct.unpack_from('<II', data, pos + len(HISTORY_MAGIC))
+        body = data[pos + head:pos + head + size]
+        if len(body) != size or zlib.crc32(body) != crc:
+            return
+        try:
+            seq = None
+            at = 0
+            if data.startswith(HISTORY_MAGIC, pos):
+                (seq,) = HISTORY_SEQ.unpack_from(body)
+                at = HISTORY_SEQ.size
+            kind, timestamp, label_len, count = HISTORY_HEAD.unpack_from(body, at)
+            at += HISTORY_HEAD.size
+            label = body[at:at + label_len].decode('utf-8')
+            at += label_len
+            deltas = {}
+            for _ in range(count):
+                name_len, offset, length = struct.unpack_from('<HII', body, at)
+                at += 10
+                name = body[at:at + name_len].decode('utf-8')
+                at += name_len
+                deltas.setdefault(name, []).append((offset, body[at:at + length], body[at + length:at + 2 * length]))
+                at += 2 * length
+            sizes = {}
+            if at < len(body):
+                (size_count,) = struct.unpack_from('<I', body, at)
+                at += 4
+                for _ in range(size_count):
+                    name_len, size_before, size_after = struct.unpack_from('<HII', body, at)
+                    at += 10
+                    sizes[body[at:at + name_len].decode('utf-8')] = (size_before, size_after)
+                    at += name_len
+        except (struct.error, UnicodeDecodeError):
+            return
+        pos += head + size
+        yield pos, kind, seq, HistoryEntry(label, timestamp, deltas, sizes, seq) if kind == HISTORY_EDIT else None
+
+def _move_entry(source, target, seq):
+    # Moves the edit a marker names (the newest one for first-format markers)
+    for i in range(len(source) - 1, -1, -1):
+        if seq is None or source[i].seq == seq:
+            target.append(source.pop(i))
+            return
+
+class EditHistory:
+    # Undo/redo stacks for one folder backed by HISTORY_FILE_NAME. undo() and redo()
+    # first check that every file still holds the bytes the edit left (or found), so a
+    # sector changed by another tool is never silently overwritten. Every call catches
+    # up with records other tools appended first, so undo() steps back the newest edit
+    # made to the folder, whichever tool made it.
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, HISTORY_FILE_NAME)
+        self.undo_stack = []
+        self.redo_stack = []
+        # Bytes of the file replayed so far and the highest edit number seen
+        self._offset = 0
+        self._seq = 0
+        self.sync()
+
+    def sync(self):
+        # Replays records appended since the last call, by this or any other tool
+        try:
+            f = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return
+        except OSError:
+            # Read-only folder: replay what is there, without the lock or tail repair
+            try:
+                with open(self.path, 'rb') as f:
+                    self._catch_up(f)
+            except OSError:
+                pass
+            return
+        with f:
+            _lock_file(f)
+            try:
+                self._catch_up(f)
+            finally:
+                _unlock_file(f)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # The history file, locked against other writers and replayed up to its end
+        with open(self.path, 'a+b') as f:
+            _lock_file(f)
+            try:
+                self._catch_up(f)
+                yield f
+            finally:
+                _unlock_file(f)
+
+    def _catch_up(self, f):
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < self._offset:
+            # Cut back or replaced by someone else: replay it from the start
+            self.undo_stack.clear()
+            self.redo_stack.clear()
+            self._offset = self._seq = 0
+        f.seek(self._offset)
+        data = f.read(size - self._offset)
+        end = 0
+        for end, kind, seq, entry in _decode_history(data):
+            if kind == HISTORY_EDIT:
+                self._seq = self._seq + 1 if seq is None else max(self._seq, seq)
+                self.undo_stack.append(entry._replace(seq=self._seq if seq is None else seq))
+                self.redo_stack.clear()
+            elif kind == HISTORY_UNDO:
+                _move_entry(self.undo_stack, self.redo_stack, seq)
+            elif kind == HISTORY_REDO:
+                _move_entry(self.redo_stack, self.undo_stack, seq)
+        self._offset += end
+        if self._offset < size and f.writable():
+            # Drop a torn tail so later appends stay readable. Records are only appended
+            # under the lock, so this is not another writer's record in progress.
+            f.truncate(self._offset)
+
+    def _append(self, f, record):
+        f.write(record)
+        f.flush()
+        self._offset += len(record)
+        if water_metrics.ENABLED:
+            water_metrics.count_io(bytes_written=len(record))
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def record(self, label, deltas, sizes=None):
+        with self._locked() as f:
+            entry = HistoryEntry(label, time.time(), deltas or {}, sizes or {}, self._seq + 1)
+            self._append(f, _encode_history_record(HISTORY_EDIT, entry.seq, entry.timestamp, label, entry.deltas, entry.sizes))
+            self._seq = entry.seq
+            self.undo_stack.append(entry)
+            self.redo_stack.clear()
+
+    def _apply(self, entry, undo):
+        # Patches the before (undo) or after (redo) bytes back as one journaled commit,
+        # then truncates (undo) or extends (redo) files whose size the edit changed.
+        # Returns {sector index: (WaterState, header bytes)} for the touched sectors.
+        file_patches = {}
+        headers = {}
+        resize = {}
+        for name in sorted(entry.deltas.keys() | entry.sizes.keys()):
+            path = os.path.join(self.folder, name)
+            header = SectorHeader.editable(read_header(path))
+            if name in entry.sizes:
+                size_before, size_after = entry.sizes[name]
+                expected_size, new_size = (size_after, size_before) if undo else (size_before, size_after)
+                if os.path.getsize(path) != expected_size:
+                    raise ValueError(f'{name} was changed after "{entry.label}"')
+                resize[name] = new_size
+            patches = []
+            for offset, before, after in entry.deltas.get(name, ()):
+                expected, replacement = (after, before) if undo else (before, after)
+                if header.view[offset:offset + len(expected)].tobytes() != expected:
+                    raise ValueError(f'{name} was changed after "{entry.label}"')
+                header.view[offset:offset + len(replacement)] = replacement
+                header.size = max(header.size, offset + len(replacement))
+                patches.append((offset, replacement))
+            file_patches[name] = patches
+            headers[name] = header
+        patch_files(self.folder, file_patches)
+        for name, size in resize.items():
+            with open(os.path.join(self.folder, name), 'r+b') as f:
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+            header = headers[name]
+            header.view[size:] = bytes(HEADER_SIZE - size)
+            header.size = size
+        result = {}
+        for name, header in headers.items():
+            match = SECTOR_FILE_RE.match(name)
+            if match:
+                result[int(match.group(1))] = (header.state(), header.tobytes())
+        return result
+
+    def _step(self, source, target, kind):
+        if not os.path.exists(self.path):
+            return {}
+        with self._locked() as f:
+            if not source:
+                return {}
+            entry = source[-1]
+            result = self._apply(entry, undo=kind == HISTORY_UNDO)
+            self._append(f, _encode_history_record(kind, entry.seq, time.time()))
+            target.append(source.pop())
+        return result
+
+    @water_metrics.timed('history_undo')
+    def undo(self):
+        return self._step(self.undo_stack, self.redo_stack, HISTORY_UNDO)
+
+    @water_metrics.timed('history_redo')
+    def redo(self):
+        return self._step(self.redo_stack, self.undo_stack, HISTORY_REDO)
+
+# Write-behind: the editor hands edits to a background thread instead of writing in the
+# Tk callback. Edits queued within `delay` seconds of each other are committed together,
+# so repeated edits to one sector cost a single read-modify-write and a burst of saves
+# shares one journaled patch with grouped fsyncs (and one undo step).
+WriteResult = namedtuple('WriteResult', 'label states counts errors')
+
+class WriteBehind:
+    # submit() returns at once; each finished commit is posted to `results` as a
+    # WriteResult with {sector: (WaterState, header bytes)} for the written sectors,
+    # {sector: number of submitted edits it covered} and [(sector, error)]. make_edits
+    # builds the SectorEdits for each commit (default: journaled edits of `folder`).
+    def __init__(self, folder, history=None, delay=0.2, make_edits=None):
+        self.folder = folder
+        self.history = history
+        self.delay = delay
+        self.make_edits = make_edits or (lambda: SectorEdits(folder, history))
+        self.results = queue.Queue()
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._labels = []
+        self._inflight = False
+        self._urgent = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='water-write-behind', daemon=True)
+        self._thread.start()
+
+    def submit(self, label, sectors, apply):
+        # apply(edits, sector) is called on the writer thread with a SectorEdits
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('write-behind queue is closed')
+            for sector_index in sectors:
+                self._pending.setdefault(sector_index, []).append(apply)
+            self._labels.append(label)
+            self._cond.notify_all()
+
+    def busy(self):
+        with self._cond:
+            return bool(self._pending) or self._inflight
+
+    def flush(self, timeout=None):
+        # Blocks until everything submitted so far is on disk; False on timeout
+        with self._cond:
+            self._urgent = True
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: not self._pending and not self._inflight, timeout)
+            finally:
+                self._urgent = False
+
+    def close(self, timeout=None):
+        # Writes out everything still queued, then stops the thread
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                deadline = time.monotonic() + self.delay
+                while not (self._urgent or self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, labels = self._pending, self._labels
+                self._pending, self._labels = {}, []
+                self._inflight = True
+            try:
+                try:
+                    result = self._commit(batch, labels)
+                except Exception as e:
+                    result = WriteResult(labels[0] if labels else '', {}, {s: len(a) for s, a in batch.items()}, [(s, str(e)) for s in sorted(batch)])
+                self.results.put(result)
+            finally:
+                with self._cond:
+                    self._inflight = False
+                    self._cond.notify_all()
+
+    def _commit(self, batch, labels):
+        label = labels[0] if len(set(labels)) == 1 else f'{len(labels)} edits'
+        counts = {sector_index: len(applies) for sector_index, applies in batch.items()}
+        edits = self.make_edits()
+        done = []
+        errors = []
+        with water_metrics.span('write_behind_commit'):
+            for sector_index, applies in sorted(batch.items()):
+                try:
+                    for apply in applies:
+                        apply(edits, sector_index)
+                except Exception as e:
+                    # Any failure (including archive read errors) costs only this sector
+                    edits.discard(sector_index)
+                    errors.append((sector_index, str(e)))
+                    continue
+                done.append(sector_index)
+            states = {}
+            if done:
+                try:
+                    committed = edits.commit(label)
+                except OSError as e:
+                    errors.extend((sector_index, f'commit failed: {e}') for sector_index in done)
+                else:
+                    states = {sector_index: (committed[sector_index], edits.header(sector_index)) for sector_index in done}
+        return WriteResult(label, states, counts, errors)
@@ -0,0 +1,145 @@
+# Change detection for a loaded SDAT folder, so edits made by other tools show up
+# without rereading every file. On Linux an inotify watch (through ctypes) reports which
+# sd{N}.csdat names were touched; elsewhere a periodic os.scandir pass compares size and
+# mtime against the previous pass (on Windows scandir returns both without a stat call).
+# Either way the watcher only names candidates: SectorIndex.refresh() decides whether a
+# sector really changed and needs decoding again.
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+from sector_io import SECTOR_FILE_RE
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+INOTIFY_EVENT = struct.Struct('iIII')
+
+def _inotify_open(folder):
+    # Returns a non-blocking inotify fd watching folder, or None where unsupported
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def stat_sectors(folder):
+    # {sector index: (size, mtime_ns)} of the sd{N}.csdat files in folder
+    stats = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            match = SECTOR_FILE_RE.match(entry.name)
+            if not match:
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            stats[int(match.group(1))] = (st.st_size, st.st_mtime_ns)
+    return stats
+
+class FolderWatcher:
+    # Collects touched sector indices on a daemon thread. changes() hands them over and
+    # returns None instead when events were lost (inotify queue overflow), meaning every
+    # sector has to be checked.
+    def __init__(self, folder, interval=2.0, use_inotify=True):
+        self.folder = folder
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._overflow = False
+        self._stop = threading.Event()
+        self._fd = _inotify_open(folder) if use_inotify else None
+        self.mode = 'inotify' if self._fd is not None else 'poll'
+        if self._fd is not None:
+            self._wake_r, self._wake_w = os.pipe()
+            target = self._run_inotify
+        else:
+            target = self._run_poll
+        self._thread = threading.Thread(target=target, name='water-folder-watch', daemon=True)
+        self._thread.start()
+
+    def changes(self):
+        with self._lock:
+            if self._overflow:
+                self._overflow = False
+                self._changed = set()
+                return None
+            changed, self._changed = self._changed, set()
+        return changed
+
+    def close(self):
+        self._stop.set()
+        if self._fd is not None:
+            os.write(self._wake_w, b'\0')
+        self._thread.join(1.0)
+        if self._fd is not None and not self._thread.is_alive():
+            for fd in (self._fd, self._wake_r, self._wake_w):
+                os.close(fd)
+            self._fd = None
+
+    def _post(self, sectors=(), overflow=False):
+        with self._lock:
+            self._changed.update(sectors)
+            self._overflow = self._overflow or overflow
+
+    def _run_inotify(self):
+        while not self._stop.is_set():
+            select.select([self._fd, self._wake_r], [], [])
+            if self._stop.is_set():
+                return
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+            sectors = set()
+            overflow = False
+            pos = 0
+            while pos + INOTIFY_EVENT.size <= len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                name = data[pos + INOTIFY_EVENT.size:pos + INOTIFY_EVENT.size + length].split(b'\0', 1)[0]
+                pos += INOTIFY_EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                match = SECTOR_FILE_RE.match(os.fsdecode(name))
+                if match:
+                    sectors.add(int(match.group(1)))
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    self._post(sectors, True)
+                    return
+            self._post(sectors, overflow)
+
+    def _run_poll(self):
+        try:
+            known = stat_sectors(self.folder)
+        except OSError:
+            known = {}
+        while not self._stop.wait(self.interval):
+            try:
+                current = stat_sectors(self.folder)
+            except OSError:
+                continue
+            self._post(s for s in known.keys() | current.keys() if known.get(s) != current.get(s))
+            known = current
@@ -0,0 +1,345 @@
+# Zip archives of .csdat files, edited in place of an extracted SDAT folder.
+# Header windows are read on demand from the members (a deflated member is only
+# inflated as far as the header) and cached. Edits stay in memory until save(), which
+# streams a new archive next to the old one: edited members are recompressed, every
+# other member's local header and compressed bytes are copied as they are, and the
+# central directory is written here from the members' ZipInfo, so the cost of a save
+# follows the edits rather than the archive size on every Python version.
+import os
+import struct
+import tempfile
+import threading
+import zipfile
+
+import water_metrics
+from sector_io import (
+    HEADER_SIZE, NO_WATER, SECTOR_FILE_RE, SectorEdits, decode_water_state, header_digest,
+)
+
+COPY_CHUNK = 1 << 20
+# Edited members are recompressed in memory up to this size, in a temporary file beyond
+SCRATCH_SIZE = 16 << 20
+
+# Zip records (APPNOTE 4.3). Sizes and offsets at or above ZIP64_LIMIT move to the zip64
+# extra field (entry counts to the zip64 end record), leaving ZIP64_MARKER in their place.
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+CENTRAL_DIR = struct.Struct('<4s4B4HL2L5H2L')
+CENTRAL_DIR_SIGNATURE = b'PK\x01\x02'
+END_RECORD = struct.Struct('<4s4H2LH')
+END_RECORD_SIGNATURE = b'PK\x05\x06'
+ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+ZIP64_END_RECORD_SIGNATURE = b'PK\x06\x06'
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_VERSION = 45
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+EXTRA_HEADER = struct.Struct('<HH')
+
+def is_sector_archive(path):
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+def _extra_blocks(extra):
+    # Yields (header id, whole block) for each block of a zip extra field
+    pos = 0
+    while pos + EXTRA_HEADER.size <= len(extra):
+        header_id, size = EXTRA_HEADER.unpack_from(extra, pos)
+        yield header_id, extra[pos:pos + EXTRA_HEADER.size + size]
+        pos += EXTRA_HEADER.size + size
+
+def _copy_member(src, info, out):
+    # Copies a member's local header, name, extra field, compressed data and data
+    # descriptor to the end of out unchanged. Returns (info, general purpose flags and
+    # name as stored in the local header, offset of the copy).
+    src.seek(info.header_offset)
+    fixed = src.read(LOCAL_HEADER.size)
+    if len(fixed) != LOCAL_HEADER.size or fixed[:4] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f'bad local header for {info.filename}')
+    fields = LOCAL_HEADER.unpack(fixed)
+    flags, name_len, extra_len = fields[3], fields[-2], fields[-1]
+    name = src.read(name_len)
+    extra = src.read(extra_len)
+    size = LOCAL_HEADER.size + name_len + extra_len + info.compress_size
+    if flags & 0x08:
+        # The descriptor has 8-byte sizes when the local header carries a zip64 field
+        src.seek(info.header_offset + size)
+        zip64 = any(header_id == ZIP64_EXTRA_ID for header_id, _ in _extra_blocks(extra))
+        size += (20 if zip64 else 12) + (4 if src.read(4) == DATA_DESCRIPTOR_SIGNATURE else 0)
+    src.seek(info.header_offset)
+    offset = out.tell()
+    _copy_bytes(src, out, size)
+    return info, flags, name, offset
+
+def _write_central_directory(out, members, comment):
+    # Writes the central directory and end records for [(info, flags, name, offset)]
+    start = out.tell()
+    for info, flags, name, offset in members:
+        zip64 = []
+        file_size, compress_size, header_offset = info.file_size, info.compress_size, offset
+        if file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT:
+            zip64 += [file_size, compress_size]
+            file_size = compress_size = ZIP64_MARKER
+        if offset >= ZIP64_LIMIT:
+            zip64.append(offset)
+            header_offset = ZIP64_MARKER
+        # A zip64 field copied from the source would describe the old sizes and offset
+        extra = b''.join(block for header_id, block in _extra_blocks(info.extra) if header_id != ZIP64_EXTRA_ID)
+        version = 0
+        if zip64:
+            extra = struct.pack(f'<HH{len(zip64)}Q', ZIP64_EXTRA_ID, 8 * len(zip64), *zip64) + extra
+            version = ZIP64_VERSION
+        year, month, day, hour, minute, second = info.date_time
+        out.write(CENTRAL_DIR.pack(
+            CENTRAL_DIR_SIGNATURE, max(version, info.create_version), info.create_system,
+            max(version, info.extract_version), info.reserved, flags, info.compress_type,
+            hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day,
+            info.CRC, compress_size, file_size, len(name), len(extra), len(info.comment),
+            0, info.internal_attr, info.external_attr, header_offset,
+        ))
+        out.write(name)
+        out.write(extra)
+        out.write(info.comment)
+    end = out.tell()
+    count, size = len(members), end - start
+    if count >= ZIP64_COUNT_MARKER or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+        out.write(ZIP64_END_RECORD.pack(
+            ZIP64_END_RECORD_SIGNATURE, ZIP64_END_RECORD.size - 12, ZIP64_VERSION, ZIP64_VERSION,
+            0, 0, count, count, size, start,
+        ))
+        out.write(ZIP64_LOCATOR.pack(ZIP64_LOCATOR_SIGNATURE, 0, end, 1))
+        count, size, start = min(count, ZIP64_COUNT_MARKER), min(size, ZIP64_MARKER), min(start, ZIP64_MARKER)
+    out.write(END_RECORD.pack(END_RECORD_SIGNATURE, 0, 0, count, count, size, start, len(comment)))
+    out.write(comment)
+
+def _copy_bytes(src, dst, size):
+    while size > 0:
+        chunk = src.read(min(size, COPY_CHUNK))
+        if not chunk:
+            raise OSError('archive member is truncated')
+        dst.write(chunk)
+        size -= len(chunk)
+
+class SectorArchive:
+    # Answers the same get/peek/put/store/scan calls as SectorIndex, so the editor can
+    # browse an archive like a folder. States are keyed by the member's size and CRC.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._zip = None
+        self._headers = {}
+        self._modified = {}
+        self._states = {}
+        self._open()
+
+    def _open(self):
+        self._zip = zipfile.ZipFile(self.path)
+        self._members = {}
+        for info in self._zip.infolist():
+            match = SECTOR_FILE_RE.match(info.filename.rsplit('/', 1)[-1])
+            if match and not info.is_dir():
+                self._members.setdefault(int(match.group(1)), info)
+
+    def close(self):
+        # Waits for a read in progress (e.g. on the scan thread) to finish first
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+
+    def _check_open(self):
+        # A closed archive reads like an unreadable file; the caller holds self._lock
+        if self._zip is None:
+            raise OSError(f'{os.path.basename(self.path)} is closed')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __contains__(self, sector_index):
+        return sector_index in self._members
+
+    def sectors(self):
+        return sorted(self._members)
+
+    @property
+    def dirty(self):
+        return bool(self._modified)
+
+    def modified(self):
+        return sorted(self._modified)
+
+    def read_header(self, sector_index):
+        # The sector's header window including unsaved edits
+        header = self._modified.get(sector_index) or self._headers.get(sector_index)
+        if header is not None:
+            return header
+        info = self._members.get(sector_index)
+        if info is None:
+            raise FileNotFoundError(f'sd{sector_index}.csdat is not in {os.path.basename(self.path)}')
+        with self._lock:
+            self._check_open()
+            with self._zip.open(info) as f:
+                header = f.read(HEADER_SIZE)
+        if water_metrics.ENABLED:
+            water_metrics.count_io(bytes_read=len(header))
+        self._headers[sector_index] = header
+        return header
+
+    def read_headers(self, sectors):
+        # Same (buffer, sizes) layout as sector_io.read_headers
+        buffer = bytearray(len(sectors) * HEADER_SIZE)
+        sizes = [-1] * len(sectors)
+        for i, sector_index in enumerate(sectors):
+            try:
+                header = self.read_header(sector_index)
+            except (OSError, zipfile.BadZipFile):
+                continue
+            buffer[i * HEADER_SIZE:i * HEADER_SIZE + len(header)] = header
+            sizes[i] = len(header)
+        return buffer, sizes
+
+    def set_header(self, sector_index, header):
+        self._modified[sector_index] = bytes(header)
+        self._states.pop(sector_index, None)
+
+    def read(self, sector_index, key=None):
+        info = self._members.get(sector_index)
+        if info is None:
+            return None, None, None
+        try:
+            header = self.read_header(sector_index)
+        except (OSError, zipfile.BadZipFile):
+            return None, NO_WATER, None
+        return (info.file_size, info.CRC), decode_water_state(header), header_digest(header)
+
+    def snapshot(self):
+        return {}
+
+    def scan(self, sector_index, known):
+        return self.read(sector_index)
+
+    def put(self, sector_index, key, state, digest=None):
+        if state is None:
+            self._states.pop(sector_index, None)
+        else:
+            self._states[sector_index] = state
+
+    def get(self, sector_index):
+        if sector_index not in self._members:
+            return None
+        state = self._states.get(sector_index)
+        if state is None:
+            key, state, digest = self.read(sector_index)
+            self._states[sector_index] = state
+        return state
+
+    def peek(self, sector_index):
+        return self._states.get(sector_index)
+
+    def store(self, sector_index, state, header=None):
+        self._states[sector_index] = state
+
+    def save_cache(self):
+        return None
+
+    def clear_cache(self):
+        # Forget decoded states and cached headers; unsaved edits are kept
+        self._headers.clear()
+        self._states.clear()
+
+    def _recompress(self, scratch, info, header):
+        # Writes the member with its header window replaced as a one-member archive into
+        # scratch, compressed with the member's original method; returns its ZipInfo there
+        member = zipfile.ZipInfo(info.filename, info.date_time)
+        member.compress_type = info.compress_type
+        member.create_system = info.create_system
+        member.external_attr = info.external_attr
+        member.comment = info.comment
+        member.file_size = max(info.file_size, len(header))
+        with zipfile.ZipFile(scratch, 'w', allowZip64=True) as out:
+            with self._zip.open(info) as src, out.open(member, 'w') as dst:
+                src.read(len(header))
+                dst.write(header)
+                while True:
+                    chunk = src.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+        return member
+
+    @water_metrics.timed('archive_save')
+    def save(self, path=None):
+        # Writes the archive with all edits to `path` (default: over the original, via a
+        # temporary file and an atomic replace). Returns (members rewritten, members copied).
+        target = os.path.abspath(path or self.path)
+        replacing = target == os.path.abspath(self.path)
+        rewritten = copied = 0
+        fd, tmp_path = tempfile.mkstemp(prefix='.water-', suffix='.zip.tmp', dir=os.path.dirname(target))
+        try:
+            with self._lock:
+                with open(fd, 'w+b') as out:
+                    self._check_open()
+                    members = []
+                    with open(self.path, 'rb') as src:
+                        for info in self._zip.infolist():
+                            match = SECTOR_FILE_RE.match(info.filename.rsplit('/', 1)[-1])
+                            sector_index = int(match.group(1)) if match else None
+                            if sector_index in self._modified and self._members[sector_index] is info:
+                                with tempfile.SpooledTemporaryFile(SCRATCH_SIZE) as scratch:
+                                    member = self._recompress(scratch, info, self._modified[sector_index])
+                                    members.append(_copy_member(scratch, member, out))
+                                rewritten += 1
+                            else:
+                                members.append(_copy_member(src, info, out))
+                                copied += 1
+                    _write_central_directory(out, members, self._zip.comment)
+                    out.flush()
+                    os.fsync(out.fileno())
+                    if water_metrics.ENABLED:
+                        water_metrics.count_io(bytes_written=out.tell(), fsyncs=1)
+                # Windows cannot replace a file that is still open, so the reader lets go
+                # first and is reopened on whichever file is there afterwards
+                if replacing:
+                    self._zip.close()
+                try:
+                    os.replace(tmp_path, target)
+                finally:
+                    if replacing:
+                        self._open()
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        if replacing:
+            # The saved headers are now what the archive holds
+            self._headers.update(self._modified)
+            self._modified.clear()
+        return rewritten, copied
+
+class ArchiveEdits(SectorEdits):
+    # SectorEdits on archive members: commit() hands the edited headers to the archive,
+    # which keeps them until SectorArchive.save(). No undo history is recorded.
+    def __init__(self, archive):
+        super().__init__(archive.path)
+        self.archive = archive
+
+    def _read(self, sector_index):
+        return self.archive.read_header(sector_index)
+
+    def commit(self, label=None):
+        for name, ranges in self._ranges.items():
+            if ranges:
+                header = self._headers[name].tobytes()
+                self.archive.set_header(self._sectors[name], header)
+                self._original[name] = header
+                ranges.clear()
+        return {self._sectors[name]: header.state() for name, header in self._headers.items()}
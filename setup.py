@@ -55,7 +55,12 @@ executables = [
         base='Win32GUI' if sys.platform == 'win32' else None,  # GUI application
         target_name='CSDat_Water_Editor.exe',  # Name of the final executable
         icon=icon_ico if icon_ico and os.path.exists(icon_ico) else None,  # Converted icon file
-    )
+    ),
+    Executable(
+        'water_cli.py',  # Headless command line (no tkinter)
+        base=None,  # Console application
+        target_name='CSDat_Water_CLI.exe',
+    ),
 ]
 
 # Setup
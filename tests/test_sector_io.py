@@ -0,0 +1,364 @@
+# Header-window reads, the intent journal and the edit history of sector_io
+import os
+import struct
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sector_io
+import water_metrics
+from sector_io import (
+    EMBEDDED_TEMPLATE, HEADER_SIZE, JOURNAL_ROLLBACK, WATER_PATHS_STR, EditHistory, SectorEdits, SectorHeader, SectorIndex,
+    WriteBehind, patch_files, read_header, read_water_state, recover_journals,
+)
+
+def make_sparse_sector(path, size):
+    # A large sector with a water header and a sparse body (no disk space used)
+    with open(path, 'wb') as f:
+        f.write(EMBEDDED_TEMPLATE + bytes(HEADER_SIZE - len(EMBEDDED_TEMPLATE)))
+        f.truncate(size)
+    return path
+
+def test_read_header_reads_only_the_window(tmp_path, monkeypatch):
+    path = make_sparse_sector(str(tmp_path / 'sd0.csdat'), 256 << 20)
+    requested = []
+    real_open = open
+
+    class CountingFile:
+        def __init__(self, f):
+            self.f = f
+
+        def read(self, n=-1):
+            requested.append(n)
+            return self.f.read(n)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.f.close()
+
+    monkeypatch.setattr(sector_io, 'open', lambda *args, **kwargs: CountingFile(real_open(*args, **kwargs)), raising=False)
+    header = read_header(path)
+    assert len(header) == HEADER_SIZE
+    assert all(0 < n <= HEADER_SIZE for n in requested)
+    assert sum(requested) <= HEADER_SIZE
+
+def test_read_header_bytes_counted(tmp_path):
+    path = make_sparse_sector(str(tmp_path / 'sd1.csdat'), 64 << 20)
+    water_metrics.enable()
+    water_metrics.reset()
+    try:
+        state = read_water_state(path)
+        io = water_metrics.snapshot()['io']
+    finally:
+        water_metrics.enable(False)
+    assert state.has_water
+    assert io['bytes_read'] == HEADER_SIZE
+
+def test_read_header_short_file(tmp_path):
+    path = str(tmp_path / 'sd2.csdat')
+    with open(path, 'wb') as f:
+        f.write(b'\x01' * 50)
+    assert read_header(path) == b'\x01' * 50
+
+def test_sector_header_over_a_view_slice():
+    # Windows packed back to back decode through memoryview slices without copies
+    first = SectorHeader.editable(EMBEDDED_TEMPLATE)
+    first.path = WATER_PATHS_STR[0]
+    second = SectorHeader.editable(EMBEDDED_TEMPLATE)
+    second.path = WATER_PATHS_STR[1]
+    second.height = 7.5
+    view = memoryview(first.tobytes() + second.tobytes())
+    header = SectorHeader(view[HEADER_SIZE:], HEADER_SIZE)
+    assert header.path == WATER_PATHS_STR[1]
+    assert header.height == 7.5
+    assert SectorHeader(view[:HEADER_SIZE]).path == WATER_PATHS_STR[0]
+
+def test_undo_restores_a_short_sector_byte_for_byte(tmp_path):
+    folder = str(tmp_path)
+    original = bytes(range(50))
+    path = os.path.join(folder, 'sd3.csdat')
+    with open(path, 'wb') as f:
+        f.write(original)
+    edits = SectorEdits(folder, EditHistory(folder))
+    edits.set_water(3, 5.0, WATER_PATHS_STR[0])
+    edits.commit('Save')
+    with open(path, 'rb') as f:
+        saved = f.read()
+    assert len(saved) == HEADER_SIZE
+    history = EditHistory(folder)
+    history.undo()
+    with open(path, 'rb') as f:
+        assert f.read() == original
+    EditHistory(folder).redo()
+    with open(path, 'rb') as f:
+        assert f.read() == saved
+
+def write_sector(folder, sector_index, data):
+    path = os.path.join(folder, f'sd{sector_index}.csdat')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def read_sector_height(folder, sector_index):
+    return SectorHeader(read_file(os.path.join(folder, f'sd{sector_index}.csdat'))).height
+
+def journals(folder):
+    return [n for n in os.listdir(folder) if n.endswith('.journal')]
+
+def write_journal(folder, file_patches, name='.water-1-1.journal'):
+    # The journal a writer that died before finishing would have left behind
+    data = sector_io._encode_journal(sector_io._journal_entries(folder, file_patches))
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(data)
+    return os.path.join(folder, name)
+
+def test_recovery_rolls_a_journal_forward(tmp_path):
+    folder = str(tmp_path)
+    path = write_sector(folder, 0, bytes(HEADER_SIZE))
+    write_journal(folder, {'sd0.csdat': [(4, b'abcd')]})
+    assert recover_journals(folder) == 1
+    assert read_file(path)[:8] == bytes(4) + b'abcd'
+    assert journals(folder) == []
+
+def test_recovery_drops_a_torn_journal(tmp_path):
+    folder = str(tmp_path)
+    path = write_sector(folder, 0, bytes(HEADER_SIZE))
+    journal = write_journal(folder, {'sd0.csdat': [(4, b'abcd')]})
+    with open(journal, 'r+b') as f:
+        f.truncate(os.path.getsize(journal) - 3)
+    assert recover_journals(folder) == 0
+    assert read_file(path) == bytes(HEADER_SIZE)
+    assert journals(folder) == []
+
+def test_recovery_finishes_a_rollback(tmp_path):
+    # The writer died after flipping its journal to roll back a write to a short file
+    folder = str(tmp_path)
+    path = write_sector(folder, 0, b'\x01' * 8)
+    journal = write_journal(folder, {'sd0.csdat': [(4, b'abcdefgh')]})
+    with open(journal, 'r+b') as f:
+        f.seek(len(sector_io.JOURNAL_MAGIC))
+        f.write(JOURNAL_ROLLBACK)
+    with open(path, 'r+b') as f:
+        f.seek(4)
+        f.write(b'abcdefgh')
+    assert recover_journals(folder) == 1
+    assert read_file(path) == b'\x01' * 8
+
+def test_recovery_skips_a_live_writers_journal(tmp_path):
+    folder = str(tmp_path)
+    path = write_sector(folder, 0, bytes(HEADER_SIZE))
+    journal = write_journal(folder, {'sd0.csdat': [(4, b'abcd')]})
+    with open(journal, 'rb') as held:
+        assert sector_io._lock_file(held)
+        assert recover_journals(folder) == 0
+    assert read_file(path) == bytes(HEADER_SIZE)
+    assert journals(folder) == [os.path.basename(journal)]
+
+def test_commit_survives_recovery_running_mid_write(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    path = write_sector(folder, 0, bytes(HEADER_SIZE))
+    roll_forward = sector_io._roll_forward
+    recovered = []
+
+    def racing(*args, **kwargs):
+        recovered.append(recover_journals(folder))
+        return roll_forward(*args, **kwargs)
+    monkeypatch.setattr(sector_io, '_roll_forward', racing)
+    patch_files(folder, {'sd0.csdat': [(4, b'abcd')]})
+    assert recovered == [0]
+    assert read_file(path)[4:8] == b'abcd'
+    assert journals(folder) == []
+
+def test_failed_commit_writes_nothing(tmp_path):
+    # A sector deleted before the commit fails it before any other file is touched
+    folder = str(tmp_path)
+    first = write_sector(folder, 0, EMBEDDED_TEMPLATE)
+    second = write_sector(folder, 1, EMBEDDED_TEMPLATE)
+    history = EditHistory(folder)
+    edits = SectorEdits(folder, history)
+    edits.set_water(0, 5.0)
+    edits.set_water(1, 6.0)
+    os.remove(second)
+    with pytest.raises(OSError):
+        edits.commit('Save')
+    assert read_file(first) == EMBEDDED_TEMPLATE
+    assert journals(folder) == []
+    write_sector(folder, 1, EMBEDDED_TEMPLATE)
+    assert recover_journals(folder) == 0
+    assert read_sector_height(folder, 1) == read_sector_height(folder, 0) == SectorHeader(EMBEDDED_TEMPLATE).height
+    assert history.undo_stack == [] and EditHistory(folder).undo_stack == []
+
+def test_failed_write_rolls_back_written_files(tmp_path, monkeypatch):
+    # The second file disappears after the targets were checked, so the first one has
+    # already been patched (and extended) when the write fails
+    folder = str(tmp_path)
+    first = write_sector(folder, 0, b'\x01' * 100)
+    second = write_sector(folder, 1, EMBEDDED_TEMPLATE)
+    journal_entries = sector_io._journal_entries
+
+    def then_delete(*args):
+        entries = journal_entries(*args)
+        os.remove(second)
+        return entries
+    monkeypatch.setattr(sector_io, '_journal_entries', then_delete)
+    with pytest.raises(OSError):
+        patch_files(folder, {'sd0.csdat': [(96, b'abcdefgh')], 'sd1.csdat': [(0, b'abcd')]})
+    assert read_file(first) == b'\x01' * 100
+    assert journals(folder) == []
+
+def rewrite_keeping_stat(path, data):
+    # Another tool's write that lands in the same mtime granule, leaving size and mtime as they were
+    st = os.stat(path)
+    with open(path, 'r+b') as f:
+        f.write(data)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+def test_racy_cache_entry_is_read_again(tmp_path):
+    folder = str(tmp_path)
+    path = write_sector(folder, 0, EMBEDDED_TEMPLATE)
+    index = SectorIndex(folder)
+    assert index.get(0).has_water
+    rewrite_keeping_stat(path, bytes(len(EMBEDDED_TEMPLATE)))
+    assert not index.get(0).has_water
+    rewrite_keeping_stat(path, EMBEDDED_TEMPLATE)
+    assert index.refresh(0)
+    assert index.save_cache() is not None
+    assert SectorIndex(folder).snapshot() == {}
+
+def test_settled_cache_entry_is_trusted(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    path = write_sector(folder, 0, EMBEDDED_TEMPLATE)
+    old = os.stat(path).st_mtime_ns - 2 * sector_io.RACY_NS
+    os.utime(path, ns=(old, old))
+    index = SectorIndex(folder)
+    state = index.get(0)
+    index.save_cache()
+    reads = []
+    monkeypatch.setattr(sector_io, 'read_header', lambda path: reads.append(path))
+    assert SectorIndex(folder).get(0) == state
+    assert not index.refresh(0)
+    assert reads == []
+
+def test_history_shared_between_writers(tmp_path):
+    # The editor and a command-line tool record into the same history while both are open
+    folder = str(tmp_path)
+    first = write_sector(folder, 0, EMBEDDED_TEMPLATE)
+    second = write_sector(folder, 1, EMBEDDED_TEMPLATE)
+    editor = EditHistory(folder)
+    tool = EditHistory(folder)
+    edits = SectorEdits(folder, editor)
+    edits.set_water(0, 5.0)
+    edits.commit('A')
+    edits = SectorEdits(folder, tool)
+    edits.set_water(1, 6.0)
+    edits.commit('B')
+    assert sorted(editor.undo()) == [1]
+    assert read_file(second) == EMBEDDED_TEMPLATE
+    reloaded = EditHistory(folder)
+    assert [e.label for e in reloaded.undo_stack] == ['A']
+    assert [e.label for e in reloaded.redo_stack] == ['B']
+    assert sorted(tool.undo()) == [0]
+    assert read_file(first) == EMBEDDED_TEMPLATE
+    assert sorted(editor.redo()) == [0]
+    assert read_sector_height(folder, 0) == 5.0
+    reloaded = EditHistory(folder)
+    assert [e.label for e in reloaded.undo_stack] == ['A']
+    assert [e.label for e in reloaded.redo_stack] == ['B']
+
+def test_history_markers_name_their_edit(tmp_path):
+    folder = str(tmp_path)
+    records = [
+        sector_io._encode_history_record(sector_io.HISTORY_EDIT, 1, 0.0, 'A'),
+        sector_io._encode_history_record(sector_io.HISTORY_EDIT, 2, 0.0, 'B'),
+        sector_io._encode_history_record(sector_io.HISTORY_UNDO, 1, 0.0),
+    ]
+    with open(os.path.join(folder, sector_io.HISTORY_FILE_NAME), 'wb') as f:
+        f.write(b''.join(records))
+    history = EditHistory(folder)
+    assert [(e.label, e.seq) for e in history.undo_stack] == [('B', 2)]
+    assert [(e.label, e.seq) for e in history.redo_stack] == [('A', 1)]
+    history.record('C', {})
+    assert history.undo_stack[-1].seq == 3
+    assert history.redo_stack == []
+
+def test_history_reads_first_format_records(tmp_path):
+    # Records without sequence numbers, whose markers apply to the newest edit
+    folder = str(tmp_path)
+
+    def record(kind, label=''):
+        body = sector_io.HISTORY_HEAD.pack(kind, 0.0, len(label), 0) + label.encode()
+        return sector_io.HISTORY_MAGIC_V1 + struct.pack('<II', len(body), zlib.crc32(body)) + body
+    with open(os.path.join(folder, sector_io.HISTORY_FILE_NAME), 'wb') as f:
+        f.write(record(sector_io.HISTORY_EDIT, 'A') + record(sector_io.HISTORY_EDIT, 'B') + record(sector_io.HISTORY_UNDO))
+    history = EditHistory(folder)
+    assert [(e.label, e.seq) for e in history.undo_stack] == [('A', 1)]
+    assert [(e.label, e.seq) for e in history.redo_stack] == [('B', 2)]
+    history.record('C', {})
+    assert [(e.label, e.seq) for e in EditHistory(folder).undo_stack] == [('A', 1), ('C', 3)]
+
+def test_write_behind_coalesces_edits(tmp_path):
+    folder = str(tmp_path)
+    write_sector(folder, 0, EMBEDDED_TEMPLATE)
+    write_sector(folder, 1, EMBEDDED_TEMPLATE)
+    history = EditHistory(folder)
+    writer = WriteBehind(folder, history, delay=5.0)
+    try:
+        for height in (1.0, 2.0, 3.0):
+            writer.submit('Save', [0], lambda edits, sector, height=height: edits.set_water(sector, height))
+        writer.submit('Reset', [1], lambda edits, sector: edits.reset(sector))
+        assert writer.flush(5.0)
+        result = writer.results.get_nowait()
+    finally:
+        writer.close(5.0)
+    assert writer.results.empty()
+    assert result.counts == {0: 3, 1: 1}
+    assert result.errors == []
+    assert result.states[0][0].height == 3.0
+    assert not result.states[1][0].has_water
+    assert read_sector_height(folder, 0) == 3.0
+    assert len(history.undo_stack) == 1 and history.undo_stack[0].label == '4 edits'
+
+def test_write_behind_isolates_failing_sectors(tmp_path):
+    folder = str(tmp_path)
+    write_sector(folder, 0, EMBEDDED_TEMPLATE)
+    write_sector(folder, 1, EMBEDDED_TEMPLATE)
+    writer = WriteBehind(folder, delay=5.0)
+    try:
+        writer.submit('Save', [0, 1, 2], lambda edits, sector: edits.set_water(sector, 4.0))
+        writer.submit('Save', [1], lambda edits, sector: edits.set_water(sector, float('nan')))
+        assert writer.flush(5.0)
+        result = writer.results.get_nowait()
+    finally:
+        writer.close(5.0)
+    assert sorted(result.states) == [0]
+    assert [sector for sector, _ in result.errors] == [1, 2]
+    assert read_sector_height(folder, 0) == 4.0
+    assert read_file(os.path.join(folder, 'sd1.csdat')) == EMBEDDED_TEMPLATE
+
+def test_write_behind_reports_a_failed_commit(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    write_sector(folder, 0, EMBEDDED_TEMPLATE)
+    history = EditHistory(folder)
+
+    def failing(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(sector_io, 'patch_files', failing)
+    writer = WriteBehind(folder, history, delay=0.0)
+    try:
+        writer.submit('Save', [0], lambda edits, sector: edits.set_water(sector, 4.0))
+        assert writer.flush(5.0)
+        result = writer.results.get_nowait()
+    finally:
+        writer.close(5.0)
+    assert result.states == {}
+    assert result.errors == [(0, 'commit failed: disk full')]
+    assert history.undo_stack == []
@@ -0,0 +1,107 @@
+# Archive save round trips: edited members are recompressed, the rest copied as stored
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sector_io import EMBEDDED_TEMPLATE, HEADER_SIZE, NO_WATER, SectorHeader
+from sector_zip import SectorArchive
+
+class StreamOnly(io.RawIOBase):
+    # An unseekable output, so zipfile writes every member with a data descriptor
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+def sector_bytes(sector_index, size=4096):
+    body = bytes((sector_index * 7 + i) % 251 for i in range(size - len(EMBEDDED_TEMPLATE)))
+    return EMBEDDED_TEMPLATE + body
+
+def build_archive(path, compression, stream=False, force_zip64=False):
+    members = {f'level/sd{i}.csdat': sector_bytes(i) for i in range(4)}
+    members['level/readme.txt'] = b'not a sector'
+    out = StreamOnly() if stream else open(path, 'wb')
+    with zipfile.ZipFile(out, 'w', compression) as z:
+        z.comment = b'archive comment'
+        z.writestr(zipfile.ZipInfo('level/'), b'')
+        for name, data in members.items():
+            info = zipfile.ZipInfo(name, (2020, 5, 17, 12, 30, 10))
+            info.compress_type = compression
+            info.comment = name.encode() + b' comment'
+            with z.open(info, 'w', force_zip64=force_zip64) as f:
+                f.write(data)
+    if stream:
+        with open(path, 'wb') as f:
+            f.write(out.data)
+    else:
+        out.close()
+    return members
+
+LAYOUTS = {
+    'stored': dict(compression=zipfile.ZIP_STORED),
+    'deflated': dict(compression=zipfile.ZIP_DEFLATED),
+    'data_descriptor': dict(compression=zipfile.ZIP_DEFLATED, stream=True),
+    'zip64_data_descriptor': dict(compression=zipfile.ZIP_DEFLATED, stream=True, force_zip64=True),
+}
+
+@pytest.mark.parametrize('layout', sorted(LAYOUTS))
+def test_save_round_trip(tmp_path, layout):
+    path = str(tmp_path / 'world.zip')
+    members = build_archive(path, **LAYOUTS[layout])
+    with zipfile.ZipFile(path) as z:
+        before = {info.filename: (info.compress_type, info.compress_size, info.comment) for info in z.infolist()}
+    with SectorArchive(path) as archive:
+        header = SectorHeader.editable(archive.read_header(2))
+        header.height = 12.5
+        archive.set_header(2, header.tobytes())
+        assert archive.save() == (1, 5)
+        assert not archive.dirty
+        assert archive.read(2)[1].height == 12.5
+    members['level/sd2.csdat'] = header.tobytes() + members['level/sd2.csdat'][HEADER_SIZE:]
+    with zipfile.ZipFile(path) as z:
+        assert z.testzip() is None
+        assert z.comment == b'archive comment'
+        assert [info.filename for info in z.infolist()] == list(before)
+        for info in z.infolist():
+            compress_type, compress_size, comment = before[info.filename]
+            assert (info.compress_type, info.comment) == (compress_type, comment)
+            if info.filename != 'level/sd2.csdat':
+                assert info.compress_size == compress_size
+            if not info.is_dir():
+                assert z.read(info) == members[info.filename]
+    with SectorArchive(path) as archive:
+        assert archive.read(2)[1].height == 12.5
+        assert archive.read(1)[1].height == SectorHeader(EMBEDDED_TEMPLATE).height
+
+def test_save_as_keeps_the_original(tmp_path):
+    path = str(tmp_path / 'world.zip')
+    copy_path = str(tmp_path / 'copy.zip')
+    build_archive(path, zipfile.ZIP_DEFLATED)
+    with open(path, 'rb') as f:
+        original = f.read()
+    with SectorArchive(path) as archive:
+        archive.set_header(0, bytes(HEADER_SIZE))
+        archive.save(copy_path)
+    with open(path, 'rb') as f:
+        assert f.read() == original
+    with SectorArchive(copy_path) as archive:
+        assert archive.read(0)[1] == NO_WATER
+    assert [n for n in os.listdir(str(tmp_path)) if n.endswith('.tmp')] == []
+
+def test_closed_archive_reads_as_unreadable(tmp_path):
+    path = str(tmp_path / 'world.zip')
+    build_archive(path, zipfile.ZIP_DEFLATED)
+    archive = SectorArchive(path)
+    archive.close()
+    assert archive.read(1) == (None, NO_WATER, None)
+    assert archive.read_headers([0, 1])[1] == [-1, -1]
@@ -0,0 +1,17 @@
+# Manifest validation rejects bad entries before any sector is touched
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from water_batch import parse_entry
+
+@pytest.mark.parametrize('height', [1e40, -1e40, 'nan', 'inf'])
+def test_parse_entry_rejects_unstorable_heights(height):
+    with pytest.raises(ValueError):
+        parse_entry({'sector': 0, 'action': 'add', 'height': height})
+
+def test_parse_entry_keeps_float32_heights():
+    assert parse_entry({'sector': 3, 'height': '4.5'})['height'] == 4.5
@@ -0,0 +1,164 @@
+# Manifest parsing and the parallel batch engine behind water_cli.
+# Each folder is one job run by a single worker, so entries for a folder are applied
+# in manifest order and committed as one journaled patch with grouped fsyncs; different
+# folders run concurrently on a thread or process pool.
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import water_metrics
+from sector_io import WATER_PATHS_STR, EditHistory, SectorEdits, check_height
+
+ACTIONS = ('add', 'set', 'reset')
+
+def resolve_material(value):
+    # Accepts a WATER_PATHS_STR index, a material file name with or without .mlm,
+    # '00' to clear, or any raw path
+    if value is None:
+        return None
+    text = str(value).strip()
+    if text == '':
+        return None
+    if text == '00':
+        return '00'
+    if text.isdigit() and int(text) < len(WATER_PATHS_STR):
+        return WATER_PATHS_STR[int(text)]
+    for path in WATER_PATHS_STR:
+        file_name = path.rsplit('\\', 1)[-1].lower()
+        if text.lower() in (file_name, file_name.rsplit('.', 1)[0]):
+            return path
+    return text
+
+def parse_entry(raw):
+    if not isinstance(raw, dict):
+        raise ValueError('manifest entry must be an object')
+    try:
+        sector = int(raw['sector'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('entry needs an integer "sector"')
+    action = str(raw.get('action') or 'set').strip().lower()
+    if action not in ACTIONS:
+        raise ValueError(f'unknown action {action!r}')
+    height = raw.get('height')
+    if height is not None and str(height).strip() != '':
+        height = check_height(height)
+    else:
+        height = None
+    return {'sector': sector, 'action': action, 'height': height, 'material': resolve_material(raw.get('material'))}
+
+def load_manifest(manifest_path):
+    # Returns the raw entries; individual entries are validated by parse_entry
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+        if manifest_path.lower().endswith('.csv'):
+            return list(csv.DictReader(f))
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('sectors', [])
+    if not isinstance(data, list):
+        raise ValueError('JSON manifest must be a list or {"sectors": [...]}')
+    return data
+
+@water_metrics.timed('apply_entries')
+def apply_entries(folder, raw_entries, edits=None):
+    # Applies all entries for one folder in order and commits them in one pass (one undo
+    # step). edits defaults to journaled SectorEdits of the folder with its history.
+    if edits is None:
+        edits = SectorEdits(folder, EditHistory(folder))
+    results = []
+    for raw in raw_entries:
+        result = {'folder': folder, 'sector': raw.get('sector') if isinstance(raw, dict) else None}
+        results.append(result)
+        try:
+            entry = parse_entry(raw)
+            result.update(sector=entry['sector'], action=entry['action'])
+            if entry['action'] == 'reset':
+                edits.reset(entry['sector'])
+            else:
+                if entry['action'] == 'add':
+                    edits.add_template(entry['sector'])
+                if entry['action'] == 'set' or entry['height'] is not None or entry['material'] is not None:
+                    edits.set_water(entry['sector'], entry['height'], entry['material'])
+            state = edits.state(entry['sector'])
+            result.update(ok=True, height=state.height, material=state.path, has_water=state.has_water)
+        except (OSError, ValueError) as e:
+            result.update(ok=False, error=str(e))
+    try:
+        edits.commit(f'Apply manifest ({len(results)} entries)')
+    except OSError as e:
+        for result in results:
+            if result['ok']:
+                result.update(ok=False, error=f'commit failed: {e}')
+    return results
+
+def load_batch_jobs(manifest_path, folders=None):
+    # Returns [(folder, raw entries)]. With folders given, every folder gets the
+    # whole manifest; otherwise each entry names its folder.
+    if folders:
+        entries = load_manifest(manifest_path)
+        return [(folder, entries) for folder in folders]
+    if not manifest_path.lower().endswith('.csv'):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and isinstance(data.get('folders'), dict):
+            return [(folder, list(entries)) for folder, entries in data['folders'].items()]
+    jobs = {}
+    for raw in load_manifest(manifest_path):
+        if not isinstance(raw, dict) or not raw.get('folder'):
+            raise ValueError('batch entries need a "folder" (or pass FOLDER arguments)')
+        jobs.setdefault(raw['folder'], []).append(raw)
+    return list(jobs.items())
+
+def default_workers():
+    return min(32, (os.cpu_count() or 1) + 4)
+
+def group_jobs(jobs):
+    # Merges (folder, entries) jobs that name the same folder, keeping entry order
+    grouped = {}
+    for folder, entries in jobs:
+        key = os.path.normcase(os.path.realpath(folder))
+        if key in grouped:
+            grouped[key][1].extend(entries)
+        else:
+            grouped[key] = (folder, list(entries))
+    return list(grouped.values())
+
+def _run_folder(folder, entries):
+    try:
+        return apply_entries(folder, entries)
+    except Exception as e:
+        return [{'folder': folder, 'sector': None, 'ok': False, 'error': f'folder failed: {e}'}]
+
+def run_batch(jobs, workers=None, use_processes=False):
+    # jobs: iterable of (folder, raw manifest entries). Returns (results, summary) with
+    # results in job order and the summary aggregating counts and errors per folder.
+    jobs = group_jobs(jobs)
+    workers = max(1, workers or default_workers())
+    start = time.perf_counter()
+    if workers == 1 or len(jobs) <= 1:
+        per_folder = [_run_folder(folder, entries) for folder, entries in jobs]
+    else:
+        executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_cls(max_workers=min(workers, len(jobs))) as executor:
+            futures = [executor.submit(_run_folder, folder, entries) for folder, entries in jobs]
+            per_folder = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    results = [result for folder_results in per_folder for result in folder_results]
+    failed = [result for result in results if not result['ok']]
+    errors = {}
+    for result in failed:
+        errors.setdefault(result['folder'], []).append({'sector': result.get('sector'), 'error': result.get('error')})
+    summary = {
+        'folders': len(jobs),
+        'entries': len(results),
+        'ok': len(results) - len(failed),
+        'failed': len(failed),
+        'workers': workers,
+        'pool': 'process' if use_processes else 'thread',
+        'elapsed': elapsed,
+        'entries_per_sec': len(results) / elapsed if elapsed > 0 else None,
+        'errors': errors,
+    }
+    return results, summary
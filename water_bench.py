@@ -0,0 +1,230 @@
+# Synthetic SDAT world generator and headless benchmark suite
+#
+#   python water_bench.py generate OUT_FOLDER [--sectors 256] [--size 64K|16K-1M] [--coverage 0.3] [--materials water_av_swamp,2]
+#   python water_bench.py run [--size 64K,1M] [--repeat 20] [--out results.json]
+#
+# 'run' builds a throwaway world per size and times folder open, full grid scans,
+# single-sector select and the save/reset/add-template write paths. Results are one
+# JSON document (timings in ms, bytes read/written and fsyncs per operation) so runs
+# can be compared across releases. I/O counts come from the water_metrics counters of
+# the I/O layer, which are switched on while an operation is measured, so they are exact
+# on every platform; OS page cache is not dropped between runs.
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+import water_metrics
+from sector_io import (
+    EMBEDDED_TEMPLATE, HEADER_SIZE, RACY_NS, WATER_PATHS_STR, SectorEdits, SectorIndex,
+    decode_water_state, list_sectors, recover_journals, sector_file_name,
+)
+from water_batch import resolve_material
+
+def parse_size(text):
+    text = str(text).strip().upper()
+    for suffix, factor in (('K', 1 << 10), ('M', 1 << 20), ('G', 1 << 30)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+def parse_size_range(text):
+    # '64K' -> 65536, '16K-1M' -> (16384, 1048576) for sizes drawn per sector
+    low, sep, high = str(text).partition('-')
+    if not sep:
+        return parse_size(low)
+    low, high = parse_size(low), parse_size(high)
+    if low > high:
+        raise argparse.ArgumentTypeError(f'size range {text} is empty')
+    return (low, high)
+
+def parse_materials(text):
+    # Material names/indices as accepted by resolve_material; anything it does not
+    # recognise must be a full .mlm path, so a typo cannot end up in sector files
+    materials = []
+    for name in text.split(','):
+        path = resolve_material(name)
+        if path is None or (path not in WATER_PATHS_STR and not (path.lower().endswith('.mlm') and '\\' in path)):
+            raise argparse.ArgumentTypeError(f'unknown material {name.strip()!r}')
+        materials.append(path)
+    return materials
+
+def generate_world(folder, sectors=256, size=64 * 1024, coverage=0.3, materials=None, seed=0):
+    # Writes sd0..sd{sectors-1}.csdat of `size` bytes (an int or a (min, max) range).
+    # About `coverage` of them get the embedded water template with a random height
+    # and a material drawn from `materials` (default: all WATER_PATHS_STR).
+    rng = random.Random(seed)
+    materials = materials or WATER_PATHS_STR
+    os.makedirs(folder, exist_ok=True)
+    edits = SectorEdits(folder)
+    for sector_index in range(sectors):
+        file_size = rng.randint(*size) if isinstance(size, tuple) else size
+        body = rng.randbytes(max(file_size, HEADER_SIZE))
+        header = bytearray(body[:HEADER_SIZE])
+        header[0xB0:0xB4] = bytes(4)
+        header[0xB9:HEADER_SIZE] = bytes(HEADER_SIZE - 0xB9)
+        with open(os.path.join(folder, sector_file_name(sector_index)), 'wb') as f:
+            f.write(header)
+            f.write(body[HEADER_SIZE:file_size])
+        if rng.random() < coverage:
+            edits.add_template(sector_index)
+            edits.set_water(sector_index, round(rng.uniform(0.5, 50.0), 2), rng.choice(materials))
+    edits.commit()
+    return folder
+
+def _legacy_decode(data):
+    # Pre-SectorHeader decode, kept for the decode microbenchmark
+    if len(data) < 0xB4:
+        return (0.0, '00', False)
+    height = struct.unpack('<f', data[0xB0:0xB4])[0]
+    path_str = data[0xB9:0x1C0].split(b'\x00')[0].decode('ascii', errors='ignore').strip() or '00'
+    return (height, path_str, (abs(height) > 1e-6) or path_str != '00')
+
+def measure(name, fn, repeat, ops_per_call=1):
+    # Times fn() `repeat` times; bytes and fsyncs are averaged per operation
+    times = []
+    io = [0, 0, 0]
+    enabled = water_metrics.ENABLED
+    water_metrics.enable()
+    try:
+        for _ in range(repeat):
+            with water_metrics.span(f'bench_{name}') as span:
+                start = time.perf_counter()
+                fn()
+                elapsed = time.perf_counter() - start
+            times.append(elapsed * 1000.0 / ops_per_call)
+            io = [total + n for total, n in zip(io, span.frame)]
+    finally:
+        water_metrics.enable(enabled)
+    ops = repeat * ops_per_call
+    times.sort()
+    return {
+        'name': name,
+        'runs': repeat,
+        'ops_per_run': ops_per_call,
+        'mean_ms': statistics.fmean(times),
+        'median_ms': statistics.median(times),
+        'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))],
+        'min_ms': times[0],
+        'bytes_read_per_op': io[0] / ops,
+        'bytes_written_per_op': io[1] / ops,
+        'fsyncs_per_op': io[2] / ops,
+    }
+
+def run_suite(size, sectors=256, coverage=0.3, repeat=20, seed=0, workdir=None):
+    folder = tempfile.mkdtemp(prefix='water_bench_', dir=workdir)
+    try:
+        generate_world(folder, sectors, size, coverage, seed=seed)
+        indices = list_sectors(folder)
+        # Age the world past the cache's racy window, like a folder that was not just
+        # written, so warm lookups measure cache hits rather than racy re-reads
+        settled = time.time_ns() - 2 * RACY_NS
+        for i in indices:
+            os.utime(os.path.join(folder, sector_file_name(i)), ns=(settled, settled))
+        rng = random.Random(seed)
+        results = []
+
+        def open_folder():
+            recover_journals(folder)
+            SectorIndex(folder, use_cache=False)
+            list_sectors(folder)
+        results.append(measure('folder_open', open_folder, repeat))
+
+        def cold_scan():
+            index = SectorIndex(folder, use_cache=False)
+            for i in indices:
+                index.get(i)
+        results.append(measure('grid_scan_cold', cold_scan, repeat))
+
+        warm = SectorIndex(folder, use_cache=False)
+        for i in indices:
+            warm.get(i)
+        results.append(measure('grid_scan_warm', lambda: [warm.get(i) for i in indices], repeat))
+        results.append(measure('select_sector', lambda: warm.get(rng.choice(indices)), repeat * 10))
+
+        def write_op(apply):
+            def op():
+                sector_index = rng.choice(indices)
+                edits = SectorEdits(folder)
+                apply(edits, sector_index)
+                warm.store(sector_index, edits.commit()[sector_index], edits.header(sector_index))
+            return op
+        results.append(measure('save', write_op(lambda e, i: e.set_water(i, rng.uniform(0.5, 50.0), rng.choice(WATER_PATHS_STR))), repeat))
+        results.append(measure('reset', write_op(lambda e, i: e.reset(i)), repeat))
+        results.append(measure('add_template', write_op(lambda e, i: e.add_template(i)), repeat))
+
+        header = EMBEDDED_TEMPLATE + bytes(HEADER_SIZE - len(EMBEDDED_TEMPLATE))
+        loops = 10000
+        results.append(measure('decode_legacy', lambda: [_legacy_decode(header) for _ in range(loops)], 5, ops_per_call=loops))
+        results.append(measure('decode_sector_header', lambda: [decode_water_state(header) for _ in range(loops)], 5, ops_per_call=loops))
+        return {'file_size': size, 'sectors': sectors, 'coverage': coverage, 'results': results}
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def cmd_generate(args):
+    generate_world(args.folder, args.sectors, args.size, args.coverage, args.materials, args.seed)
+    print(json.dumps({'folder': args.folder, 'sectors': args.sectors}))
+    return 0
+
+def cmd_run(args):
+    report = {
+        'tool': 'water_bench',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'worlds': [],
+    }
+    for size in args.size.split(','):
+        if args.metrics:
+            water_metrics.enable()
+            water_metrics.reset()
+        world = run_suite(parse_size(size), args.sectors, args.coverage, args.repeat, args.seed, args.workdir)
+        if args.metrics:
+            world['metrics'] = water_metrics.snapshot()
+        report['worlds'].append(world)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Synthetic .csdat worlds and editor benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate', help='write a synthetic SDAT folder')
+    generate.add_argument('folder')
+    generate.add_argument('--sectors', type=int, default=256)
+    generate.add_argument('--size', type=parse_size_range, default='64K', help='sector file size, e.g. 64K or 4M, or a MIN-MAX range such as 16K-1M')
+    generate.add_argument('--coverage', type=float, default=0.3, help='fraction of sectors with water')
+    generate.add_argument('--materials', type=parse_materials, help='comma-separated material names (water_av_swamp), indices or full .mlm paths to draw from')
+    generate.add_argument('--seed', type=int, default=0)
+    generate.set_defaults(func=cmd_generate)
+    run = commands.add_parser('run', help='run the benchmark suite and print JSON')
+    run.add_argument('--sectors', type=int, default=256)
+    run.add_argument('--size', default='64K,1M', help='comma-separated sector file sizes')
+    run.add_argument('--coverage', type=float, default=0.3)
+    run.add_argument('--repeat', type=int, default=20)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--workdir', help='where to build the temporary worlds')
+    run.add_argument('--out', help='write the JSON report here instead of stdout')
+    run.add_argument('--metrics', action='store_true', help='also record water_metrics and embed them in the report')
+    run.set_defaults(func=cmd_run)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
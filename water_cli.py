@@ -0,0 +1,229 @@
+# Headless command line for .csdat water editing (no tkinter import)
+#
+#   python water_cli.py state FOLDER
+#   python water_cli.py apply FOLDER MANIFEST.json|MANIFEST.csv
+#   python water_cli.py batch MANIFEST [FOLDER ...] [--workers N] [--processes]
+#   python water_cli.py history FOLDER
+#   python water_cli.py undo|redo FOLDER [--steps N]
+#   python water_cli.py report FOLDER [--csv OUT.csv] [--json OUT.json]
+#   python water_cli.py diff SOURCE DEST
+#   python water_cli.py sync SOURCE DEST [--sectors 3,17,40]
+#   python water_cli.py --metrics-json metrics.json <command> ...
+#
+# A manifest lists per-sector settings: {"sector": 12, "action": "set", "height": 4.5,
+# "material": "water_av_swamp"}. JSON manifests are a list of such objects (or
+# {"sectors": [...]}); CSV manifests use the columns sector,action,height,material.
+# action is add (template, then optional height/material), set (default) or reset.
+# Results are printed as one JSON object per line. For batch, a manifest without
+# FOLDER arguments names the folders itself: {"folders": {"path": [entries]}} or
+# entries carrying a "folder" key (a folder column in CSV). apply, batch and the editor
+# record every commit in the folder's .water_history file; undo/redo step through it.
+# state, apply and report also take a .zip of sector files in place of FOLDER; apply
+# then rewrites only the edited members of the archive (no undo history).
+import argparse
+import json
+import sys
+import time
+
+import water_metrics
+from sector_io import EditHistory, SectorIndex, list_sectors, recover_journals
+from water_batch import apply_entries, default_workers, load_batch_jobs, load_manifest, run_batch
+from sector_zip import ArchiveEdits, SectorArchive, is_sector_archive
+from water_diff import compare_folders, sync_sectors
+
+def emit(result, out=sys.stdout):
+    out.write(json.dumps(result) + '\n')
+
+def cmd_state(args):
+    if is_sector_archive(args.folder):
+        index = SectorArchive(args.folder)
+        sectors = index.sectors()
+    else:
+        recover_journals(args.folder)
+        index = SectorIndex(args.folder, use_cache=not args.no_cache)
+        sectors = list_sectors(args.folder)
+    for sector in sectors:
+        state = index.get(sector)
+        if state is None:
+            emit({'folder': args.folder, 'sector': sector, 'ok': False, 'error': 'sector file disappeared'})
+        else:
+            emit({'folder': args.folder, 'sector': sector, 'ok': True, 'height': state.height,
+                  'material': state.path, 'has_water': state.has_water})
+    index.save_cache()
+    if isinstance(index, SectorArchive):
+        index.close()
+    return 0
+
+def cmd_apply(args):
+    try:
+        raw_entries = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        emit({'ok': False, 'error': f'bad manifest: {e}'})
+        return 2
+    if is_sector_archive(args.folder):
+        results = apply_archive(args.folder, raw_entries)
+    else:
+        recover_journals(args.folder)
+        results = apply_entries(args.folder, raw_entries)
+    for result in results:
+        emit(result)
+    return 0 if all(r['ok'] for r in results) else 1
+
+def apply_archive(path, raw_entries):
+    with SectorArchive(path) as archive:
+        results = apply_entries(path, raw_entries, ArchiveEdits(archive))
+        if archive.dirty:
+            try:
+                archive.save()
+            except OSError as e:
+                for result in results:
+                    if result['ok']:
+                        result.update(ok=False, error=f'archive save failed: {e}')
+    return results
+
+def cmd_batch(args):
+    try:
+        jobs = load_batch_jobs(args.manifest, args.folders)
+    except (OSError, ValueError) as e:
+        emit({'ok': False, 'error': f'bad manifest: {e}'})
+        return 2
+    for folder, _ in jobs:
+        recover_journals(folder)
+    results, summary = run_batch(jobs, workers=args.workers, use_processes=args.processes)
+    if not args.summary_only:
+        for result in results:
+            emit(result)
+    emit({'summary': summary})
+    return 0 if summary['failed'] == 0 else 1
+
+def cmd_history(args):
+    history = EditHistory(args.folder)
+    entries = [(entry, False) for entry in history.undo_stack] + [(entry, True) for entry in reversed(history.redo_stack)]
+    for step, (entry, undone) in enumerate(entries, 1):
+        emit({'step': step, 'label': entry.label, 'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(entry.timestamp)),
+              'sectors': len(entry.deltas.keys() | entry.sizes.keys()), 'bytes': sum(len(before) for deltas in entry.deltas.values() for _, before, _ in deltas),
+              'undone': undone})
+    return 0
+
+def cmd_step(args):
+    recover_journals(args.folder)
+    history = EditHistory(args.folder)
+    undo = args.command == 'undo'
+    for _ in range(args.steps):
+        history.sync()
+        stack = history.undo_stack if undo else history.redo_stack
+        if not stack:
+            emit({'ok': False, 'error': f'nothing to {args.command}'})
+            return 1
+        label = stack[-1].label
+        try:
+            changed = history.undo() if undo else history.redo()
+        except (OSError, ValueError) as e:
+            emit({'ok': False, 'label': label, 'error': str(e)})
+            return 1
+        emit({'ok': True, args.command: label, 'sectors': sorted(changed)})
+    return 0
+
+def cmd_report(args):
+    # Imported here so commands that make no report never load it (or NumPy)
+    from water_report import build_report, write_csv, write_json
+    if not is_sector_archive(args.folder):
+        recover_journals(args.folder)
+    rows, summary = build_report(args.folder, use_numpy=not args.no_numpy, workers=args.workers)
+    if args.csv:
+        write_csv(rows, args.csv)
+    if args.json:
+        write_json(rows, summary, args.json)
+    if not (args.csv or args.json):
+        for row in rows:
+            emit(row)
+    emit({'summary': summary})
+    return 0
+
+def cmd_diff(args):
+    start = time.perf_counter()
+    diffs, _ = compare_folders(args.source, args.dest, workers=args.workers)
+    for diff in diffs:
+        emit(diff)
+    emit({'summary': {status: sum(1 for d in diffs if d['status'] == status) for status in ('changed', 'source_only', 'dest_only')} | {'elapsed': time.perf_counter() - start}})
+    return 0
+
+def cmd_sync(args):
+    recover_journals(args.dest)
+    diffs, source_headers = compare_folders(args.source, args.dest, workers=args.workers)
+    sectors = [d['sector'] for d in diffs if d['status'] == 'changed']
+    if args.sectors:
+        wanted = {int(s) for s in args.sectors.split(',') if s.strip()}
+        sectors = [s for s in sectors if s in wanted]
+    if not sectors:
+        emit({'ok': True, 'synced': []})
+        return 0
+    try:
+        states = sync_sectors(args.dest, sectors, source_headers)
+    except OSError as e:
+        emit({'ok': False, 'error': str(e)})
+        return 1
+    for sector in sectors:
+        state = states[sector]
+        emit({'folder': args.dest, 'sector': sector, 'ok': True, 'height': state.height, 'material': state.path, 'has_water': state.has_water})
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='AVATAR: The Game water editor (headless)')
+    parser.add_argument('--metrics-json', metavar='PATH', help='record I/O and latency metrics and write them here')
+    commands = parser.add_subparsers(dest='command', required=True)
+    state = commands.add_parser('state', help='print the water state of every sector in a folder')
+    state.add_argument('folder', help='SDAT folder or .zip archive')
+    state.add_argument('--no-cache', action='store_true', help='ignore and do not write the sector summary cache')
+    state.set_defaults(func=cmd_state)
+    apply = commands.add_parser('apply', help='apply a JSON/CSV manifest of sector water settings')
+    apply.add_argument('folder', help='SDAT folder or .zip archive')
+    apply.add_argument('manifest')
+    apply.set_defaults(func=cmd_apply)
+    batch = commands.add_parser('batch', help='apply a manifest to many folders in parallel')
+    batch.add_argument('manifest', help='per-folder manifest, or per-sector manifest applied to every FOLDER')
+    batch.add_argument('folders', nargs='*', metavar='FOLDER')
+    batch.add_argument('--workers', type=int, default=default_workers(), help='parallel folder jobs')
+    batch.add_argument('--processes', action='store_true', help='use a process pool instead of threads')
+    batch.add_argument('--summary-only', action='store_true', help='print only the aggregated summary')
+    batch.set_defaults(func=cmd_batch)
+    history = commands.add_parser('history', help='list the recorded edits of a folder')
+    history.add_argument('folder')
+    history.set_defaults(func=cmd_history)
+    for name in ('undo', 'redo'):
+        step = commands.add_parser(name, help=f'{name} the last recorded edit(s) of a folder')
+        step.add_argument('folder')
+        step.add_argument('--steps', type=int, default=1)
+        step.set_defaults(func=cmd_step)
+    report = commands.add_parser('report', help='audit heights, materials and template bytes of every sector')
+    report.add_argument('folder', help='SDAT folder or .zip archive')
+    report.add_argument('--csv', metavar='PATH', help='write one row per sector as CSV')
+    report.add_argument('--json', metavar='PATH', help='write the rows and summary as JSON')
+    report.add_argument('--workers', type=int, default=1, help='parallel header reads (helps on network drives)')
+    report.add_argument('--no-numpy', action='store_true', help='use the pure Python scanner')
+    report.set_defaults(func=cmd_report)
+    diff = commands.add_parser('diff', help='list sectors whose water header differs between two folders')
+    diff.add_argument('source')
+    diff.add_argument('dest')
+    diff.add_argument('--workers', type=int, help='parallel header reads per folder')
+    diff.set_defaults(func=cmd_diff)
+    sync = commands.add_parser('sync', help='copy differing water headers from SOURCE into DEST')
+    sync.add_argument('source')
+    sync.add_argument('dest')
+    sync.add_argument('--sectors', help='comma-separated sectors to copy (default: every changed sector)')
+    sync.add_argument('--workers', type=int, help='parallel header reads per folder')
+    sync.set_defaults(func=cmd_sync)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.metrics_json:
+        return args.func(args)
+    water_metrics.enable()
+    try:
+        return args.func(args)
+    finally:
+        water_metrics.dump(args.metrics_json)
+
+if __name__ == '__main__':
+    sys.exit(main())
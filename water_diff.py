@@ -0,0 +1,73 @@
+# Header-only comparison and sync of two SDAT folders (e.g. two mod variants).
+# Only the water header window of each sd{N}.csdat is read, on a thread pool for both
+# folders, and compared by hash with the per-sector byte at 0x14 masked out, so
+# comparing two worlds costs about as much as reading their headers.
+import os
+
+import water_metrics
+from sector_io import (
+    HEADER_SIZE, SECTOR_BYTE_OFFSET, TEMPLATE_MASK, WATER_HEIGHT_OFFSET, WATER_PATH_OFFSET, EditHistory,
+    SectorEdits, SectorHeader, header_digest, list_sectors, read_headers, sector_file_name,
+)
+
+def default_workers():
+    return min(16, (os.cpu_count() or 1) * 2)
+
+def _load_windows(folder, sectors, workers):
+    buffer, sizes = read_headers([os.path.join(folder, sector_file_name(i)) for i in sectors], workers)
+    view = memoryview(buffer)
+    headers = {}
+    for i, sector_index in enumerate(sectors):
+        if sizes[i] >= 0:
+            headers[sector_index] = SectorHeader(view[i * HEADER_SIZE:(i + 1) * HEADER_SIZE], sizes[i])
+    return headers
+
+def _masked_digest(header):
+    window = bytearray(header.view)
+    window[SECTOR_BYTE_OFFSET] = 0
+    return header_digest(window)
+
+def _changed_fields(a, b):
+    fields = []
+    if a.view[WATER_HEIGHT_OFFSET:WATER_HEIGHT_OFFSET + 4] != b.view[WATER_HEIGHT_OFFSET:WATER_HEIGHT_OFFSET + 4]:
+        fields.append('height')
+    if a.view[WATER_PATH_OFFSET:HEADER_SIZE] != b.view[WATER_PATH_OFFSET:HEADER_SIZE]:
+        fields.append('material')
+    if any(TEMPLATE_MASK[i] and a.view[i] != b.view[i] for i in range(len(TEMPLATE_MASK))):
+        fields.append('template')
+    return fields
+
+@water_metrics.timed('compare_folders')
+def compare_folders(source, dest, workers=None):
+    # Returns (diffs, source headers) where diffs lists every sector whose water header
+    # differs or that exists on one side only:
+    # {'sector', 'status': 'changed'|'source_only'|'dest_only', 'fields', 'source', 'dest'}
+    workers = workers or default_workers()
+    source_sectors = list_sectors(source)
+    dest_sectors = list_sectors(dest)
+    source_headers = _load_windows(source, source_sectors, workers)
+    dest_headers = _load_windows(dest, dest_sectors, workers)
+    diffs = []
+    for sector_index in sorted(set(source_headers) | set(dest_headers)):
+        a = source_headers.get(sector_index)
+        b = dest_headers.get(sector_index)
+        if a is not None and b is not None and _masked_digest(a) == _masked_digest(b):
+            continue
+        diff = {
+            'sector': sector_index,
+            'status': 'changed' if a is not None and b is not None else 'source_only' if a is not None else 'dest_only',
+            'fields': _changed_fields(a, b) if a is not None and b is not None else [],
+        }
+        for side, header in (('source', a), ('dest', b)):
+            state = header.state() if header is not None else None
+            diff[side] = None if state is None else {'height': state.height, 'material': state.path, 'has_water': state.has_water}
+        diffs.append(diff)
+    return diffs, source_headers
+
+def sync_sectors(dest, sectors, source_headers, label=None):
+    # Copies the source water header of each sector into dest as one journaled commit
+    # (one undo step), keeping dest's own 0x14 byte. Returns {sector: WaterState}.
+    edits = SectorEdits(dest, EditHistory(dest))
+    for sector_index in sectors:
+        edits.copy_water(sector_index, source_headers[sector_index])
+    return edits.commit(label or f'Sync {len(sectors)} sectors')
@@ -0,0 +1,177 @@
+# Opt-in I/O and latency instrumentation for the editor's hot paths.
+#
+# Disabled by default (or enabled with WATER_METRICS=1): timed() wrappers and the
+# count_io() hooks in sector_io then cost one module-global check per call. When
+# enabled, every timed operation records its call count, wall time, a log2 latency
+# histogram and the bytes read/written and fsyncs issued while it (and anything it
+# called on the same thread) ran.
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+ENABLED = os.environ.get('WATER_METRICS', '') not in ('', '0')
+
+_lock = threading.Lock()
+_local = threading.local()
+
+class OpStats:
+    __slots__ = ('calls', 'total', 'min', 'max', 'bytes_read', 'bytes_written', 'fsyncs', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.fsyncs = 0
+        # histogram[k] counts calls that took < 2**k microseconds
+        self.histogram = {}
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'total_ms': self.total * 1000.0,
+            'mean_ms': self.total * 1000.0 / self.calls if self.calls else 0.0,
+            'min_ms': (self.min or 0.0) * 1000.0,
+            'max_ms': self.max * 1000.0,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'fsyncs': self.fsyncs,
+            'histogram_us': {f'<{1 << k}': n for k, n in sorted(self.histogram.items())},
+        }
+
+_ops = {}
+_io = {'reads': 0, 'bytes_read': 0, 'writes': 0, 'bytes_written': 0, 'fsyncs': 0}
+_since = time.time()
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = bool(on)
+
+def reset():
+    global _since
+    with _lock:
+        _ops.clear()
+        for key in _io:
+            _io[key] = 0
+        _since = time.time()
+
+def _frames():
+    frames = getattr(_local, 'frames', None)
+    if frames is None:
+        frames = _local.frames = []
+    return frames
+
+def count_io(bytes_read=0, bytes_written=0, fsyncs=0):
+    # Called by the I/O layer only while ENABLED
+    with _lock:
+        if bytes_read:
+            _io['reads'] += 1
+            _io['bytes_read'] += bytes_read
+        if bytes_written:
+            _io['writes'] += 1
+            _io['bytes_written'] += bytes_written
+        _io['fsyncs'] += fsyncs
+    frames = _frames()
+    if frames:
+        frame = frames[-1]
+        frame[0] += bytes_read
+        frame[1] += bytes_written
+        frame[2] += fsyncs
+
+def record(name, seconds, bytes_read=0, bytes_written=0, fsyncs=0):
+    bucket = int(seconds * 1e6).bit_length()
+    with _lock:
+        stats = _ops.get(name)
+        if stats is None:
+            stats = _ops[name] = OpStats()
+        stats.calls += 1
+        stats.total += seconds
+        stats.min = seconds if stats.min is None else min(stats.min, seconds)
+        stats.max = max(stats.max, seconds)
+        stats.bytes_read += bytes_read
+        stats.bytes_written += bytes_written
+        stats.fsyncs += fsyncs
+        stats.histogram[bucket] = stats.histogram.get(bucket, 0) + 1
+
+class _Span:
+    __slots__ = ('name', 'frame', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.frame = [0, 0, 0]
+        _frames().append(self.frame)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        frames = _frames()
+        frames.pop()
+        frame = self.frame
+        record(self.name, elapsed, *frame)
+        # Nested operations roll their I/O up into the caller
+        if frames:
+            parent = frames[-1]
+            parent[0] += frame[0]
+            parent[1] += frame[1]
+            parent[2] += frame[2]
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name):
+    # with span('name'): ... times a block, or does nothing while disabled
+    return _Span(name) if ENABLED else _NO_SPAN
+
+def timed(name):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def snapshot():
+    with _lock:
+        return {
+            'enabled': ENABLED,
+            'since': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_since)),
+            'io': dict(_io),
+            'ops': {name: stats.as_dict() for name, stats in sorted(_ops.items())},
+        }
+
+def dump(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f, indent=2)
+        f.write('\n')
+
+def format_table():
+    # Plain-text summary for the diagnostics panel
+    snap = snapshot()
+    io = snap['io']
+    lines = [
+        f"I/O  reads {io['reads']}  read {io['bytes_read']:,} B  writes {io['writes']}  written {io['bytes_written']:,} B  fsyncs {io['fsyncs']}",
+        '',
+        f"{'operation':<22}{'calls':>7}{'mean ms':>10}{'max ms':>10}{'read B':>11}{'written B':>11}{'fsync':>7}",
+    ]
+    for name, op in snap['ops'].items():
+        lines.append(f"{name:<22}{op['calls']:>7}{op['mean_ms']:>10.3f}{op['max_ms']:>10.3f}{op['bytes_read']:>11,}{op['bytes_written']:>11,}{op['fsyncs']:>7}")
+    return '\n'.join(lines)
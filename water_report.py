@@ -0,0 +1,141 @@
+# Whole-folder water audit: which sectors have water, their heights and materials,
+# materials outside WATER_PATHS_STR, and water sectors whose template bytes differ from
+# EMBEDDED_TEMPLATE. With NumPy every header window is stacked into one structured array
+# and classified in vectorized form; without it (the frozen build excludes numpy) the
+# same report is built per sector through SectorHeader.
+import csv
+import functools
+import json
+import os
+
+import water_metrics
+from sector_io import (
+    EMBEDDED_TEMPLATE, FIX_BYTES, FIX_OFFSET_START, HEADER_SIZE, SECTOR_BYTE_OFFSET, TEMPLATE_END, TEMPLATE_MASK,
+    WATER_HEIGHT_OFFSET, WATER_PATH_LEN, WATER_PATH_OFFSET, WATER_PATHS_BYTES, WATER_PATHS_STR,
+    SectorHeader, list_sectors, read_headers, sector_file_name,
+)
+from sector_zip import SectorArchive, is_sector_archive
+
+REPORT_FIELDS = ('sector', 'has_water', 'height', 'material', 'material_known', 'template', 'template_diff_bytes')
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    # (numpy, header dtype), or None without NumPy. Loaded on the first vectorized report,
+    # so importing this module (and every water_cli command) does not pay for NumPy.
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    # One record per header window; fields overlap the raw template bytes on purpose
+    header_dtype = np.dtype({
+        'names': ['template', 'sector_byte', 'fix', 'height', 'path'],
+        'formats': [(np.uint8, TEMPLATE_END), np.uint8, (np.uint8, len(FIX_BYTES)), '<f4', (np.uint8, WATER_PATH_LEN)],
+        'offsets': [0, SECTOR_BYTE_OFFSET, FIX_OFFSET_START, WATER_HEIGHT_OFFSET, WATER_PATH_OFFSET],
+        'itemsize': HEADER_SIZE,
+    })
+    return np, header_dtype
+
+def _template_check(header_bytes, size, has_water):
+    if not has_water:
+        return 'none', 0
+    diff = sum(1 for i in range(TEMPLATE_END) if TEMPLATE_MASK[i] and (header_bytes[i] if i < size else 0) != EMBEDDED_TEMPLATE[i])
+    return ('match' if diff == 0 else 'mismatch'), diff
+
+def _report_python(sectors, buffer, sizes):
+    rows = []
+    view = memoryview(buffer)
+    for i, (sector_index, size) in enumerate(zip(sectors, sizes)):
+        if size < 0:
+            continue
+        window = view[i * HEADER_SIZE:(i + 1) * HEADER_SIZE]
+        state = SectorHeader(window, size).state()
+        template, diff = _template_check(window, size, state.has_water)
+        rows.append({
+            'sector': sector_index, 'has_water': state.has_water, 'height': state.height, 'material': state.path,
+            'material_known': state.path in WATER_PATHS_STR, 'template': template, 'template_diff_bytes': diff,
+        })
+    return rows
+
+def _report_numpy(sectors, buffer, sizes):
+    np, header_dtype = _numpy()
+    headers = np.frombuffer(buffer, dtype=header_dtype)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    readable = sizes >= 0
+    has_fields = sizes >= WATER_HEIGHT_OFFSET + 4
+    heights = np.where(has_fields, headers['height'].astype(np.float64), 0.0)
+    paths = headers['path']
+
+    # Known materials are matched as exact NUL-terminated byte strings; anything else
+    # that is not empty is decoded like SectorHeader.path (rare, so per row)
+    material_index = np.full(len(headers), -1, dtype=np.int16)
+    for k, encoded in enumerate(WATER_PATHS_BYTES):
+        expected = np.frombuffer(encoded, dtype=np.uint8)
+        match = (paths[:, :len(expected)] == expected).all(axis=1) & (paths[:, len(expected)] == 0)
+        material_index[match & (material_index < 0)] = k
+    empty = (paths[:, 0] == 0) | ~has_fields
+    materials = np.array(WATER_PATHS_STR + ['00'], dtype=object)[np.where(empty, len(WATER_PATHS_STR), material_index)]
+    for i in np.flatnonzero(~empty & (material_index < 0)):
+        materials[i] = SectorHeader(memoryview(buffer)[i * HEADER_SIZE:(i + 1) * HEADER_SIZE], int(sizes[i])).path
+    no_path = materials == '00'
+    has_water = has_fields & ((np.abs(heights) > 1e-6) | ~no_path)
+    known = np.isin(materials, WATER_PATHS_STR)
+
+    # Zero-padded windows compare like the short files they came from
+    template = np.frombuffer(EMBEDDED_TEMPLATE, dtype=np.uint8)
+    mask = np.frombuffer(TEMPLATE_MASK, dtype=np.uint8).astype(bool)
+    diff = ((headers['template'] != template) & mask).sum(axis=1)
+    diff = np.where(has_water, diff, 0)
+
+    rows = []
+    for i in np.flatnonzero(readable):
+        wet = bool(has_water[i])
+        rows.append({
+            'sector': sectors[i], 'has_water': wet, 'height': float(heights[i]), 'material': materials[i],
+            'material_known': bool(known[i]), 'template': ('match' if diff[i] == 0 else 'mismatch') if wet else 'none',
+            'template_diff_bytes': int(diff[i]),
+        })
+    return rows
+
+def summarize(rows):
+    wet = [row for row in rows if row['has_water']]
+    heights = [row['height'] for row in wet]
+    return {
+        'sectors': len(rows),
+        'with_water': len(wet),
+        'height_min': min(heights) if heights else None,
+        'height_max': max(heights) if heights else None,
+        'height_mean': sum(heights) / len(heights) if heights else None,
+        'materials': {material: sum(1 for row in wet if row['material'] == material) for material in sorted({row['material'] for row in wet})},
+        'unknown_material': [row['sector'] for row in rows if row['material'] != '00' and not row['material_known']],
+        'template_mismatch': [row['sector'] for row in rows if row['template'] == 'mismatch'],
+    }
+
+@water_metrics.timed('water_report')
+def build_report(folder, use_numpy=True, workers=1):
+    # Returns (rows, summary); rows follow REPORT_FIELDS, one per readable sector file
+    if isinstance(folder, SectorArchive) or is_sector_archive(folder):
+        # An open archive includes its unsaved edits
+        archive = folder if isinstance(folder, SectorArchive) else SectorArchive(folder)
+        sectors = archive.sectors()
+        buffer, sizes = archive.read_headers(sectors)
+        if archive is not folder:
+            archive.close()
+    else:
+        sectors = list_sectors(folder)
+        buffer, sizes = read_headers([os.path.join(folder, sector_file_name(i)) for i in sectors], workers)
+    vectorized = use_numpy and _numpy() is not None
+    rows = (_report_numpy if vectorized else _report_python)(sectors, buffer, sizes)
+    summary = summarize(rows)
+    summary['engine'] = 'numpy' if vectorized else 'python'
+    return rows, summary
+
+def write_csv(rows, path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def write_json(rows, summary, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'sectors': rows}, f, indent=2)
+        f.write('\n')